@@ -2,15 +2,32 @@
 
 import os
 import re
-import threading
+import asyncio
+import random
 import json
 import math
 import datetime
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
-from http.server import HTTPServer, BaseHTTPRequestHandler
 from typing import Dict, List, Any, Optional, Set, Tuple
 
+try:
+    import fcntl
+except ImportError:  # Windows 本地调试没有 fcntl
+    fcntl = None
+
+try:
+    import uvloop  # 可选：libuv 事件循环，回调与 socket 开销更低
+except ImportError:
+    uvloop = None
+
+try:
+    import orjson  # 可选：C 实现的 JSON 库，群组状态文件读写优先使用
+except ImportError:
+    orjson = None
+
 import requests  # 当前没有用到，用于以后需要时保留
 
 # ========== 加载环境 ==========
@@ -43,11 +60,13 @@ SUPER_ADMINS: Set[int] = _parse_id_list(OWNER_ID_ENV) | _parse_id_list(SUPER_ADM
 DATA_DIR = Path("./data")
 GROUPS_DIR = DATA_DIR / "groups"
 LOG_DIR = DATA_DIR / "logs"
+PRIVATE_LOG_DIR = LOG_DIR / "private_chats"
 ADMINS_FILE = DATA_DIR / "admins.json"
 
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 GROUPS_DIR.mkdir(parents=True, exist_ok=True)
 LOG_DIR.mkdir(parents=True, exist_ok=True)
+PRIVATE_LOG_DIR.mkdir(parents=True, exist_ok=True)
 
 # 群组状态缓存 {chat_id: state_dict}
 groups_state: Dict[int, Dict[str, Any]] = {}
@@ -85,8 +104,7 @@ def load_group_state(chat_id: int) -> Dict[str, Any]:
     file_path = group_file_path(chat_id)
     if file_path.exists():
         try:
-            with file_path.open("r", encoding="utf-8") as f:
-                state = json.load(f)
+            state = _load_json(file_path.read_bytes())
 
             # 兼容老数据补齐字段
             state.setdefault("recent", {"in": [], "out": []})
@@ -99,8 +117,11 @@ def load_group_state(chat_id: int) -> Dict[str, Any]:
             state.setdefault("bot_name", "东启海外支付")
             state.setdefault("last_date", "")
 
-            # 补齐出金手续费字段
-            state["defaults"].setdefault("out", {})
+            # 补齐入/出金费率、汇率和出金手续费字段：之后读取直接按 key 取值
+            for direction in ("in", "out"):
+                d = state["defaults"].setdefault(direction, {})
+                d.setdefault("rate", 0.0)
+                d.setdefault("fx", 0.0)
             state["defaults"]["out"].setdefault("fee_usdt", 0.0)
 
             # ✅ 新增字段兼容
@@ -113,22 +134,67 @@ def load_group_state(chat_id: int) -> Dict[str, Any]:
             print(f"⚠️ 加载群组状态文件失败: {e}")
 
     state = get_default_state()
+    # 只放进缓存，不在读取路径上写盘；首次修改时才落文件
     groups_state[chat_id] = state
-    save_group_state(chat_id)
     return state
 
 
-def save_group_state(chat_id: int) -> None:
-    if chat_id not in groups_state:
-        return
-    file_path = group_file_path(chat_id)
+# 输出格式与 json.dumps(ensure_ascii=False, indent=2) 一致（UTF-8 原文、两格缩进）
+if orjson is not None:
+    def _dump_state(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+
+    _load_json = orjson.loads
+else:
+    def _dump_state(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+    _load_json = json.loads
+
+
+# 磁盘写入线程：handler 里不做同步文件 I/O，事件循环可以继续收发消息。
+# 只用一个线程，保证同一文件的多次写入按提交顺序完成（旧快照不会覆盖新快照）
+_io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="app-io")
+
+
+async def _run_io(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_io_executor, fn, *args)
+
+
+def _write_file_atomic(file_path: Path, payload: bytes) -> None:
+    # 先写临时文件再原子替换，Web 查账同时读取时不会读到写了一半的 JSON。
+    # 临时文件用 mkstemp 创建：Bot、Web 和多个 gunicorn worker 同时写同一文件时各用各的临时文件
+    tmp_path = None
     try:
-        with file_path.open("w", encoding="utf-8") as f:
-            json.dump(groups_state[chat_id], f, ensure_ascii=False, indent=2)
+        fd, tmp_name = tempfile.mkstemp(dir=file_path.parent, prefix=f"{file_path.name}.", suffix=".tmp")
+        tmp_path = Path(tmp_name)
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        # mkstemp 创建的文件是 0600，改回普通数据文件的权限
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
     except Exception as e:
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
         print(f"❌ 保存群组状态文件失败: {e}")
 
 
+async def save_group_state_async(chat_id: int) -> None:
+    """
+    handler 内使用：在事件循环里序列化（避免与其他协程并发修改 state），
+    落盘交给线程执行，不阻塞事件循环。
+    """
+    if chat_id not in groups_state:
+        return
+    if _flush_task is not None:
+        # 后台任务运行中：只标记脏，由 flush_group_states 合并写盘
+        _dirty_groups.add(chat_id)
+        _flush_wake.set()
+        return
+    payload = _dump_state(groups_state[chat_id])
+    await _run_io(_write_file_atomic, group_file_path(chat_id), payload)
+
+
 # ========== 机器人管理员（额外权限） ==========
 admins_cache: Optional[List[int]] = None
 
@@ -149,36 +215,51 @@ def load_admins() -> List[int]:
             print(f"⚠️ 加载管理员文件失败: {e}")
 
     admins_cache = []
-    save_admins(admins_cache)
     return admins_cache
 
 
-def save_admins(admin_list: List[int]) -> None:
-    global admins_cache
-    admins_cache = admin_list
+# 管理员 ID 集合：权限判断走 O(1) 查找；save_admins 时失效
+admin_ids_cache: Optional[Set[int]] = None
+
+
+def admin_id_set() -> Set[int]:
+    global admin_ids_cache
+    if admin_ids_cache is None:
+        admin_ids_cache = set(load_admins())
+    return admin_ids_cache
+
+
+def _write_admins_file(payload: bytes) -> None:
     try:
-        with ADMINS_FILE.open("w", encoding="utf-8") as f:
-            json.dump({"admins": admin_list}, f, ensure_ascii=False, indent=2)
+        ADMINS_FILE.write_bytes(payload)
     except Exception as e:
         print(f"❌ 保存管理员文件失败: {e}")
 
 
-def add_admin(user_id: int) -> bool:
+async def save_admins(admin_list: List[int]) -> None:
+    global admins_cache, admin_ids_cache
+    # 缓存立即更新，权限判断马上生效；写盘交给 I/O 线程
+    admins_cache = admin_list
+    admin_ids_cache = None
+    await _run_io(_write_admins_file, _dump_state({"admins": admin_list}))
+
+
+async def add_admin(user_id: int) -> bool:
+    if user_id in admin_id_set():
+        return False
     admins = load_admins()
-    if user_id not in admins:
-        admins.append(user_id)
-        save_admins(admins)
-        return True
-    return False
+    admins.append(user_id)
+    await save_admins(admins)
+    return True
 
 
-def remove_admin(user_id: int) -> bool:
+async def remove_admin(user_id: int) -> bool:
+    if user_id not in admin_id_set():
+        return False
     admins = load_admins()
-    if user_id in admins:
-        admins.remove(user_id)
-        save_admins(admins)
-        return True
-    return False
+    admins.remove(user_id)
+    await save_admins(admins)
+    return True
 
 
 def list_admins() -> List[int]:
@@ -186,9 +267,24 @@ def list_admins() -> List[int]:
 
 
 # ========== 工具函数 ==========
+# 热路径正则模块级预编译
+_AMOUNT_RE = re.compile(r"^[\+\-]\s*([0-9]+(?:\.[0-9]+)?)\s*([万千kKwW]?)")
+_COUNTRY_RE = re.compile(r"/\s*([^\s]+)$")
+_UNIT_MULTIPLIERS = {"千": 1000, "k": 1000, "K": 1000, "万": 10000, "w": 10000, "W": 10000}
+# 简单设置命令：6 字前缀 -> (方向, 字段)
+SIMPLE_SETTING_COMMANDS = {
+    "设置入金费率": ("in", "rate"),
+    "设置入金汇率": ("in", "fx"),
+    "设置出金费率": ("out", "rate"),
+    "设置出金汇率": ("out", "fx"),
+}
+_SCOPE_SETTING_RE = re.compile(r"^设置\s*(.+?)(入|出)(费率|汇率)\s*(\d+(?:\.\d+)?)\s*$")
+_HHMM_RE = re.compile(r"^([01]\d|2[0-3]):([0-5]\d)$")
+
+
 def trunc2(x: float) -> float:
-    rounded = round(float(x), 6)
-    return math.floor(rounded * 100.0) / 100.0
+    # +5e-5 相当于先按 6 位小数取整：吸收 x*100 的浮点误差（如 2538.68*100 = 253867.99999999997）
+    return math.floor(x * 100.0 + 5e-5) / 100.0
 
 
 def round2(x: float) -> float:
@@ -212,9 +308,12 @@ def fmt_rate_percent(rate: float) -> str:
     return f"{s}%"
 
 
+# 北京时间（UTC+8，无夏令时），模块级只构造一次
+BEIJING_TZ = datetime.timezone(datetime.timedelta(hours=8))
+
+
 def _beijing_now() -> datetime.datetime:
-    beijing_tz = datetime.timezone(datetime.timedelta(hours=8))
-    return datetime.datetime.now(beijing_tz)
+    return datetime.datetime.now(BEIJING_TZ)
 
 
 def now_ts() -> str:
@@ -225,9 +324,15 @@ def today_str() -> str:
     return _beijing_now().strftime("%Y-%m-%d")
 
 
+def now_ts_date() -> Tuple[str, str]:
+    """(HH:MM, YYYY-MM-DD)：一次取时间同时得到两者，handler 入口用"""
+    now = _beijing_now()
+    return now.strftime("%H:%M"), now.strftime("%Y-%m-%d")
+
+
 def _parse_hhmm(hhmm: str) -> Tuple[int, int]:
     hhmm = (hhmm or "").strip()
-    m = re.match(r"^([01]\d|2[0-3]):([0-5]\d)$", hhmm)
+    m = _HHMM_RE.match(hhmm)
     if not m:
         return 0, 0
     return int(m.group(1)), int(m.group(2))
@@ -250,7 +355,7 @@ def _current_period_id(reset_time: str) -> str:
     return period_date.strftime("%Y-%m-%d")
 
 
-def check_and_reset_daily(chat_id: int) -> bool:
+async def check_and_reset_daily(chat_id: int) -> bool:
     """按设定清空时间（北京时间）跨账期自动清空（在下一次群消息触发时执行）"""
     state = load_group_state(chat_id)
 
@@ -263,7 +368,7 @@ def check_and_reset_daily(chat_id: int) -> bool:
         state["last_period"] = period
         # 兼容：保留 last_date 字段（不影响）
         state["last_date"] = today_str()
-        save_group_state(chat_id)
+        await save_group_state_async(chat_id)
         return False
 
     # 跨账期：清空
@@ -274,33 +379,140 @@ def check_and_reset_daily(chat_id: int) -> bool:
         state["summary"]["sent_usdt"] = 0.0
         state["last_period"] = period
         state["last_date"] = today_str()
-        save_group_state(chat_id)
+        await save_group_state_async(chat_id)
         return True
 
     return False
 
 
+# 已创建的日志目录缓存 {(chat_id, country): Path}，避免每条记账都 mkdir
+_log_dir_cache: Dict[Tuple[int, Optional[str]], Path] = {}
+
+
 def log_path(chat_id: int, country: Optional[str], date_str: str) -> Path:
-    folder = f"group_{chat_id}"
-    if country:
-        folder = f"{folder}/{country}"
-    else:
-        folder = f"{folder}/通用"
-    p = LOG_DIR / folder
-    p.mkdir(parents=True, exist_ok=True)
+    key = (chat_id, country)
+    p = _log_dir_cache.get(key)
+    if p is None:
+        folder = f"group_{chat_id}"
+        if country:
+            folder = f"{folder}/{country}"
+        else:
+            folder = f"{folder}/通用"
+        p = LOG_DIR / folder
+        p.mkdir(parents=True, exist_ok=True)
+        _log_dir_cache[key] = p
     return p / f"{date_str}.log"
 
 
-def append_log(path: Path, text: str) -> None:
+# 后台批量落盘：处理消息时只改内存并唤醒后台任务，后台任务再等一个周期后统一写盘
+# - 账单日志：每个文件只 open/write 一次
+# - 群组状态：同一群组周期内多次修改只序列化、写入一次
+FLUSH_INTERVAL = 0.05
+_pending_logs: Dict[Path, List[str]] = {}
+_dirty_groups: Set[int] = set()
+_flush_task: Optional[asyncio.Task] = None
+_flush_stop: Optional[asyncio.Event] = None
+# 有待写内容时置位；空闲时后台任务只等待这个事件，不做定时轮询
+_flush_wake: Optional[asyncio.Event] = None
+
+
+def _write_log_lines(path: Path, lines: List[str]) -> None:
     with path.open("a", encoding="utf-8") as f:
-        f.write(text.strip() + "\n")
+        f.write("".join(lines))
+
+
+def append_log(path: Path, text: str) -> None:
+    line = text.strip() + "\n"
+    if _flush_task is None:
+        # 后台任务未启动（脚本/调试场景）时直接写
+        _write_log_lines(path, [line])
+        return
+    _pending_logs.setdefault(path, []).append(line)
+    _flush_wake.set()
+
+
+def _write_log_batch(batch: Dict[Path, List[str]]) -> None:
+    for path, lines in batch.items():
+        try:
+            _write_log_lines(path, lines)
+        except Exception as e:
+            print(f"❌ 写入账单日志失败: {e}")
+
+
+async def flush_logs() -> None:
+    global _pending_logs
+    if not _pending_logs:
+        return
+    # 换出待写队列在事件循环里做，写文件交给线程
+    batch, _pending_logs = _pending_logs, {}
+    await _run_io(_write_log_batch, batch)
+
 
+def _write_group_files(payloads: List[Tuple[Path, bytes]]) -> None:
+    for file_path, payload in payloads:
+        _write_file_atomic(file_path, payload)
 
-def push_recent(chat_id: int, kind: str, item: Dict[str, Any]) -> None:
+
+async def flush_group_states() -> None:
+    if not _dirty_groups:
+        return
+    chat_ids = list(_dirty_groups)
+    _dirty_groups.clear()
+    # 序列化在事件循环里做（与 handler 串行，读到的是一致的 state），写盘交给线程
+    # 单个群组序列化失败只跳过该群组，不影响其他群组落盘
+    payloads: List[Tuple[Path, bytes]] = []
+    for cid in chat_ids:
+        if cid not in groups_state:
+            continue
+        try:
+            payloads.append((group_file_path(cid), _dump_state(groups_state[cid])))
+        except Exception as e:
+            print(f"❌ 序列化群组状态失败 chat_id={cid}: {e}")
+    await _run_io(_write_group_files, payloads)
+
+
+async def _flusher() -> None:
+    while True:
+        await _flush_wake.wait()
+        if not _flush_stop.is_set():
+            # 防抖：唤醒后再等一个周期，把这段时间内的修改合并成一次写盘
+            await asyncio.sleep(FLUSH_INTERVAL)
+        _flush_wake.clear()
+        # 单次落盘出错只记录日志：任务必须继续运行，否则之后的修改只进队列、永远不会写盘
+        try:
+            await flush_logs()
+        except Exception as e:
+            print(f"❌ 后台写入账单日志失败: {e}")
+        try:
+            await flush_group_states()
+        except Exception as e:
+            print(f"❌ 后台保存群组状态失败: {e}")
+        if _flush_stop.is_set():
+            return
+
+
+async def start_flusher() -> None:
+    global _flush_task, _flush_stop, _flush_wake
+    _flush_stop = asyncio.Event()
+    _flush_wake = asyncio.Event()
+    _flush_task = asyncio.create_task(_flusher())
+
+
+async def stop_flusher() -> None:
+    """停止后台任务；任务退出前会把剩余日志和群组状态全部写完"""
+    global _flush_task
+    if _flush_task is not None:
+        _flush_stop.set()
+        _flush_wake.set()
+        await _flush_task
+        _flush_task = None
+
+
+async def push_recent(chat_id: int, kind: str, item: Dict[str, Any]) -> None:
     state = load_group_state(chat_id)
     arr = state["recent"][kind]
     arr.insert(0, item)  # 最新放在前面
-    save_group_state(chat_id)
+    await save_group_state_async(chat_id)
 
 
 def resolve_params(chat_id: int, direction: str, country: Optional[str]) -> Dict[str, float]:
@@ -309,9 +521,8 @@ def resolve_params(chat_id: int, direction: str, country: Optional[str]) -> Dict
     - rate / fx 若国家专属没设置，则用 defaults
     """
     state = load_group_state(chat_id)
-    countries = state.get("countries", {})
-    defaults = state.get("defaults", {})
-    res: Dict[str, float] = {"rate": 0.0, "fx": 0.0}
+    countries = state["countries"]
+    defaults = state["defaults"][direction]  # load_group_state 已补齐 rate / fx
 
     rate: Optional[float] = None
     fx: Optional[float] = None
@@ -322,13 +533,11 @@ def resolve_params(chat_id: int, direction: str, country: Optional[str]) -> Dict
             fx = countries[country][direction].get("fx")
 
     if rate is None:
-        rate = defaults.get(direction, {}).get("rate", 0.0)
+        rate = defaults["rate"]
     if fx is None:
-        fx = defaults.get(direction, {}).get("fx", 0.0)
+        fx = defaults["fx"]
 
-    res["rate"] = float(rate or 0.0)
-    res["fx"] = float(fx or 0.0)
-    return res
+    return {"rate": float(rate), "fx": float(fx)}
 
 
 def parse_amount_and_country(text: str) -> Tuple[Optional[float], Optional[str]]:
@@ -340,19 +549,22 @@ def parse_amount_and_country(text: str) -> Tuple[Optional[float], Optional[str]]
       +1万 / 日本
     """
     s = text.strip()
-    m = re.match(r"^[\+\-]\s*([0-9]+(?:\.[0-9]+)?)\s*([万千kKwW]?)", s)
+    # 首字符不是 +/- 直接返回，不进正则
+    if s[:1] not in ("+", "-"):
+        return None, None
+    m = _AMOUNT_RE.match(s)
     if not m:
         return None, None
 
     amount = float(m.group(1))
     unit = m.group(2)
 
-    if unit in ("千", "k", "K"):
-        amount *= 1000
-    elif unit in ("万", "w", "W"):
-        amount *= 10000
+    mult = _UNIT_MULTIPLIERS.get(unit)
+    if mult is not None:
+        amount *= mult
 
-    m2 = re.search(r"/\s*([^\s]+)$", s)
+    # 绝大多数记账消息不带国家，没有 "/" 时跳过正则
+    m2 = _COUNTRY_RE.search(s) if "/" in s else None
     country = m2.group(1) if m2 else None
     return amount, country
 
@@ -374,7 +586,7 @@ def is_bot_admin(user_id: int) -> bool:
     """机器人管理员 / 超级管理员：可以操作所有记账功能"""
     if is_super_admin(user_id):
         return True
-    return user_id in load_admins()
+    return user_id in admin_id_set()
 
 
 def can_manage_bot_admin(user_id: int) -> bool:
@@ -387,12 +599,22 @@ def compute_totals(state: Dict[str, Any]) -> Dict[str, Any]:
     rec_in = state.get("recent", {}).get("in", [])
     rec_out = state.get("recent", {}).get("out", [])
 
-    normal_out = [r for r in rec_out if r.get("type") != "下发"]
-    send_out = [r for r in rec_out if r.get("type") == "下发"]
+    # 出账记录一次遍历：同时完成普通出金 / 下发的分组和求和
+    normal_out: List[Dict[str, Any]] = []
+    send_out: List[Dict[str, Any]] = []
+    out_sum = 0.0
+    send_sum = 0.0
+    for r in rec_out:
+        if r.get("type") == "下发":
+            send_out.append(r)
+            send_sum += r.get("usdt", 0.0)
+        else:
+            normal_out.append(r)
+            out_sum += r.get("usdt", 0.0)
 
-    total_in = trunc2(sum(float(r.get("usdt", 0.0)) for r in rec_in))
-    total_out = trunc2(sum(float(r.get("usdt", 0.0)) for r in normal_out))
-    total_send = trunc2(sum(float(r.get("usdt", 0.0)) for r in send_out))
+    total_in = trunc2(sum(r.get("usdt", 0.0) for r in rec_in))
+    total_out = trunc2(out_sum)
+    total_send = trunc2(send_sum)
 
     should = total_in                          # 应下发 = 已入账合计
     sent = trunc2(total_out + total_send)      # 已下发 = 出账合计 + 下发合计
@@ -417,124 +639,97 @@ def _render_line_peer(r: Dict[str, Any]) -> str:
     return f" [{peer}]" if peer else ""
 
 
-def render_group_summary(chat_id: int) -> str:
-    state = load_group_state(chat_id)
-    bot = state.get("bot_name", "东启海外支付")
-    reset_time = state.get("reset_time", "00:00")
+# 记录里的 usdt / rate / fee_usdt 写入时已是 float，渲染时不再重复 float()
+def _render_in_line(r: Dict[str, Any], fin: float, rin: float) -> str:
+    return (
+        f"{r.get('ts', '')} {r.get('raw', 0)}  {fmt_rate_percent(r.get('rate', rin))}/ {r.get('fx', fin)}"
+        f" = {trunc2(r.get('usdt', 0.0))}{_render_line_peer(r)}"
+    )
 
-    totals = compute_totals(state)
+
+def _render_out_line(r: Dict[str, Any], fout: float, rout: float) -> str:
+    fee = r.get("fee_usdt", 0.0)
+    fee_txt = f" (含手续费{fee:.2f})" if fee > 0 else ""
+    return (
+        f"{r.get('ts', '')} {r.get('raw', 0)}  {fmt_rate_percent(r.get('rate', rout))}/ {r.get('fx', fout)}"
+        f" = {round2(r.get('usdt', 0.0))}{fee_txt}{_render_line_peer(r)}"
+    )
+
+
+def _render_send_line(r: Dict[str, Any]) -> str:
+    # 保留正负
+    return f"{r.get('ts', '')} {trunc2(r.get('usdt', 0.0))}{_render_line_peer(r)}"
+
+
+def _render_record_lines(
+    title: str, totals: Dict[str, Any], rates: Tuple[float, float, float, float], limit: Optional[int]
+) -> List[str]:
+    """账单明细部分（汇总与完整账单共用），limit 为 None 时显示全部"""
+    rin, fin, rout, fout = rates
     rec_in = totals["rec_in"]
     normal_out = totals["normal_out"]
     send_out = totals["send_out"]
+    return [
+        title,
+        f"已入账 ({len(rec_in)}笔)",
+        *[_render_in_line(r, fin, rin) for r in rec_in[:limit]],
+        "",
+        f"已出账 ({len(normal_out)}笔)",
+        *[_render_out_line(r, fout, rout) for r in normal_out[:limit]],
+        "",
+        f"已下发记录 ({len(send_out)}笔)",
+        *[_render_send_line(r) for r in send_out[:limit]],
+        "",
+    ]
 
-    rin = float(state["defaults"]["in"]["rate"])
-    fin = float(state["defaults"]["in"]["fx"])
-    rout = float(state["defaults"]["out"]["rate"])
-    fout = float(state["defaults"]["out"]["fx"])
-
-    lines: List[str] = []
-    lines.append(f"【{bot} 账单汇总】\n")
-
-    # 入金（前5条）
-    lines.append(f"已入账 ({len(rec_in)}笔)")
-    for r in rec_in[:5]:
-        raw = r.get("raw", 0)
-        fx = r.get("fx", fin)
-        rate = float(r.get("rate", rin))
-        usdt = trunc2(float(r.get("usdt", 0.0)))
-        ts = r.get("ts", "")
-        lines.append(f"{ts} {raw}  {fmt_rate_percent(rate)}/ {fx} = {usdt}{_render_line_peer(r)}")
-    lines.append("")
-
-    # 出金（前5条）
-    lines.append(f"已出账 ({len(normal_out)}笔)")
-    for r in normal_out[:5]:
-        raw = r.get("raw", 0)
-        fx = r.get("fx", fout)
-        rate = float(r.get("rate", rout))
-        usdt = round2(float(r.get("usdt", 0.0)))
-        ts = r.get("ts", "")
-        fee = float(r.get("fee_usdt", 0.0))
-        fee_txt = f" (含手续费{fee:.2f})" if fee > 0 else ""
-        lines.append(f"{ts} {raw}  {fmt_rate_percent(rate)}/ {fx} = {usdt}{fee_txt}{_render_line_peer(r)}")
-    lines.append("")
-
-    # 下发（前5条，保留正负）
-    lines.append(f"已下发记录 ({len(send_out)}笔)")
-    for r in send_out[:5]:
-        ts = r.get("ts", "")
-        usdt = trunc2(float(r.get("usdt", 0.0)))  # 保留正负
-        lines.append(f"{ts} {usdt}{_render_line_peer(r)}")
-    lines.append("")
-
-    lines.append(f"当前费率： 入 {fmt_rate_percent(rin)} ⇄ 出 {fmt_rate_percent(abs(rout))}")
-    lines.append(f"固定汇率： 入 {fin} ⇄ 出 {fout}")
-    lines.append(f"应下发：{fmt_usdt(totals['should'])}")
-    lines.append(f"已下发：{fmt_usdt(totals['sent'])}")
-    lines.append(f"未下发：{fmt_usdt(totals['diff'])}")
-    lines.append("")
-    lines.append("**查看更多记录**：发送「更多记录」")
-    return "\n".join(lines)
+
+def _default_rates(state: Dict[str, Any]) -> Tuple[float, float, float, float]:
+    d = state["defaults"]
+    return float(d["in"]["rate"]), float(d["in"]["fx"]), float(d["out"]["rate"]), float(d["out"]["fx"])
+
+
+def render_group_summary(chat_id: int) -> str:
+    state = load_group_state(chat_id)
+    bot = state.get("bot_name", "东启海外支付")
+    totals = compute_totals(state)
+    rates = _default_rates(state)
+    rin, fin, rout, fout = rates
+
+    lines = _render_record_lines(f"【{bot} 账单汇总】\n", totals, rates, 5)
+    footer = (
+        f"当前费率： 入 {fmt_rate_percent(rin)} ⇄ 出 {fmt_rate_percent(abs(rout))}\n"
+        f"固定汇率： 入 {fin} ⇄ 出 {fout}\n"
+        f"应下发：{fmt_usdt(totals['should'])}\n"
+        f"已下发：{fmt_usdt(totals['sent'])}\n"
+        f"未下发：{fmt_usdt(totals['diff'])}\n"
+        "\n"
+        "**查看更多记录**：发送「更多记录」"
+    )
+    return "\n".join(lines) + "\n" + footer
 
 
 def render_full_summary(chat_id: int) -> str:
     state = load_group_state(chat_id)
     bot = state.get("bot_name", "东启海外支付")
     reset_time = state.get("reset_time", "00:00")
-
     totals = compute_totals(state)
-    rec_in = totals["rec_in"]
-    normal_out = totals["normal_out"]
-    send_out = totals["send_out"]
-
-    rin = float(state["defaults"]["in"]["rate"])
-    fin = float(state["defaults"]["in"]["fx"])
-    rout = float(state["defaults"]["out"]["rate"])
-    fout = float(state["defaults"]["out"]["fx"])
+    rates = _default_rates(state)
+    rin, fin, rout, fout = rates
     fee_usdt = float(state["defaults"]["out"].get("fee_usdt", 0.0))
 
-    lines: List[str] = []
-    lines.append(f"【{bot} 完整账单】\n")
-
-    lines.append(f"已入账 ({len(rec_in)}笔)")
-    for r in rec_in:
-        raw = r.get("raw", 0)
-        fx = r.get("fx", fin)
-        rate = float(r.get("rate", rin))
-        usdt = trunc2(float(r.get("usdt", 0.0)))
-        ts = r.get("ts", "")
-        lines.append(f"{ts} {raw}  {fmt_rate_percent(rate)}/ {fx} = {usdt}{_render_line_peer(r)}")
-    lines.append("")
-
-    lines.append(f"已出账 ({len(normal_out)}笔)")
-    for r in normal_out:
-        raw = r.get("raw", 0)
-        fx = r.get("fx", fout)
-        rate = float(r.get("rate", rout))
-        usdt = round2(float(r.get("usdt", 0.0)))
-        ts = r.get("ts", "")
-        fee = float(r.get("fee_usdt", 0.0))
-        fee_txt = f" (含手续费{fee:.2f})" if fee > 0 else ""
-        lines.append(f"{ts} {raw}  {fmt_rate_percent(rate)}/ {fx} = {usdt}{fee_txt}{_render_line_peer(r)}")
-    lines.append("")
-
-    lines.append(f"已下发记录 ({len(send_out)}笔)")
-    for r in send_out:
-        ts = r.get("ts", "")
-        usdt = trunc2(float(r.get("usdt", 0.0)))
-        lines.append(f"{ts} {usdt}{_render_line_peer(r)}")
-    lines.append("")
-
-    lines.append("━━━━━━━━━━━━━━")
-    lines.append(f"清空时间（北京时间）：{reset_time}（账期 24 小时）")
-    lines.append(f"当前费率： 入 {fmt_rate_percent(rin)} ⇄ 出 {fmt_rate_percent(abs(rout))}")
-    lines.append(f"固定汇率： 入 {fin} ⇄ 出 {fout}")
-    lines.append(f"出金手续费： {fee_usdt:.2f} USDT/笔")
-    lines.append(f"应下发：{fmt_usdt(totals['should'])}")
-    lines.append(f"已下发：{fmt_usdt(totals['sent'])}")
-    lines.append(f"未下发：{fmt_usdt(totals['diff'])}")
-    lines.append("━━━━━━━━━━━━━━")
-    return "\n".join(lines)
+    lines = _render_record_lines(f"【{bot} 完整账单】\n", totals, rates, None)
+    footer = (
+        "━━━━━━━━━━━━━━\n"
+        f"清空时间（北京时间）：{reset_time}（账期 24 小时）\n"
+        f"当前费率： 入 {fmt_rate_percent(rin)} ⇄ 出 {fmt_rate_percent(abs(rout))}\n"
+        f"固定汇率： 入 {fin} ⇄ 出 {fout}\n"
+        f"出金手续费： {fee_usdt:.2f} USDT/笔\n"
+        f"应下发：{fmt_usdt(totals['should'])}\n"
+        f"已下发：{fmt_usdt(totals['sent'])}\n"
+        f"未下发：{fmt_usdt(totals['diff'])}\n"
+        "━━━━━━━━━━━━━━"
+    )
+    return "\n".join(lines) + "\n" + footer
 
 
 # ========== Telegram ==========
@@ -546,6 +741,37 @@ from telegram.ext import (
     filters,
     ContextTypes,
 )
+from telegram.error import NetworkError, RetryAfter
+import httpx  # python-telegram-bot 的 HTTP 后端，用来判断请求是否已经发出
+
+
+# ========== 发送消息（限流 / 超时重试） ==========
+REPLY_MAX_ATTEMPTS = 3
+# handler 是串行执行的，等待期间其他消息都处理不了：Telegram 要求等待更久时直接放弃，不再重试
+REPLY_MAX_RETRY_AFTER = 5
+# 这些底层错误说明请求没有发到 Telegram（连接未建立 / 连接池没有空位），重试不会重复发消息
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+async def safe_reply_text(message, text: str, **kwargs):
+    """
+    reply_text 的重试封装：
+    - RetryAfter：按 Telegram 要求的秒数等待后重试（超过 REPLY_MAX_RETRY_AFTER 秒不重试）
+    - 请求确定没有发出的网络错误：指数退避 + 随机抖动后重试
+    读超时等错误不重试：Telegram 可能已经收到并发出消息，重试会重复发送账单
+    """
+    for attempt in range(REPLY_MAX_ATTEMPTS):
+        try:
+            return await message.reply_text(text, **kwargs)
+        except RetryAfter as e:
+            delay = float(e.retry_after)
+            if attempt == REPLY_MAX_ATTEMPTS - 1 or delay > REPLY_MAX_RETRY_AFTER:
+                raise
+            await asyncio.sleep(delay)
+        except NetworkError as e:
+            if attempt == REPLY_MAX_ATTEMPTS - 1 or not isinstance(e.__cause__, _NOT_SENT_ERRORS):
+                raise
+            await asyncio.sleep(0.2 * (2 ** attempt) + random.random() * 0.3)
 
 
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -554,7 +780,8 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if chat.type == "private":
         if is_bot_admin(user.id):
-            await update.message.reply_text(
+            await safe_reply_text(
+                update.message,
                 "🤖 你好，我是财务记账机器人。\n\n"
                 "📊 记账操作（仅机器人管理员 / 超级管理员）：\n"
                 "  入金：+10000 或 +10000 / 日本\n"
@@ -587,14 +814,16 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "📌 提示：你在群里操作入金/出金/下发时，如果是“回复某人的消息”再发指令，账单会显示对方名字前4位。"
             )
         else:
-            await update.message.reply_text(
+            await safe_reply_text(
+                update.message,
                 "👋 你好！欢迎使用财务记账机器人\n\n"
                 "• +0 可查看账单汇总\n"
                 "• 更多记录 可查看完整账单\n\n"
                 "如需记账权限，请联系超级管理员设置你为机器人管理员。"
             )
     else:
-        await update.message.reply_text(
+        await safe_reply_text(
+            update.message,
             "🤖 你好，我是财务记账机器人。\n\n"
             "📌 所有人可用：\n"
             "  +0 查看汇总 / 更多记录 查看完整账单\n\n"
@@ -625,22 +854,158 @@ async def resolve_target_user_for_admin(update: Update, context: ContextTypes.DE
     return None
 
 
+# 精确匹配的指令集合（text 已 strip）
+FULL_SUMMARY_COMMANDS = frozenset({"更多记录", "查看更多记录", "更多账单", "显示历史账单"})
+ADMIN_MANAGE_COMMANDS = frozenset({"设置管理员", "删除管理员", "显示管理员"})
+RESET_TIME_QUERY_COMMANDS = frozenset({"查看清空时间", "当前清空时间"})
+RESET_DEFAULTS_COMMANDS = frozenset({"重置默认值", "恢复默认值"})
+CLEAR_DATA_COMMANDS = frozenset({"清除数据", "清空数据", "清楚数据", "清除账单", "清空账单"})
+
+
+# ========== 查看清空时间 ==========
+async def _cmd_show_reset_time(update: Update, chat_id: int, state: Dict[str, Any], ts: str, dstr: str) -> None:
+    rt = state.get("reset_time", "00:00")
+    await safe_reply_text(update.message, f"⏰ 当前每日清空时间（北京时间）：{rt}\n📌 账期长度：24 小时。")
+
+
+# ========== 重置默认值 ==========
+async def _cmd_reset_defaults(update: Update, chat_id: int, state: Dict[str, Any], ts: str, dstr: str) -> None:
+    state["defaults"] = {
+        "in": {"rate": 0.10, "fx": 153},
+        "out": {
+            "rate": 0.02,
+            "fx": 137,
+            "fee_usdt": float(state["defaults"]["out"].get("fee_usdt", 0.0)),
+        },
+    }
+    await save_group_state_async(chat_id)
+    await safe_reply_text(
+        update.message,
+        "✅ 已重置为推荐默认值\n\n"
+        "📥 入金设置：费率 10% / 汇率 153\n"
+        "📤 出金设置：费率 2% / 汇率 137\n"
+        f"🧾 出金手续费：{float(state['defaults']['out'].get('fee_usdt', 0.0)):.2f} USDT/笔"
+    )
+
+
+# ========== 清空今日数据 ==========
+async def _cmd_clear_data(update: Update, chat_id: int, state: Dict[str, Any], ts: str, dstr: str) -> None:
+    totals = compute_totals(state)
+    in_count = len(state["recent"]["in"])
+    out_count = len(state["recent"]["out"])
+
+    state["recent"]["in"] = []
+    state["recent"]["out"] = []
+    state["summary"]["should_send_usdt"] = 0.0
+    state["summary"]["sent_usdt"] = 0.0
+    await save_group_state_async(chat_id)
+
+    msg = (
+        "✅ 已清除当前账期所有数据\n\n"
+        f"📥 入金记录：{in_count} 笔\n"
+        f"📤 出金 + 下发记录：{out_count} 笔\n"
+        f"🧾 清除前应下发：{fmt_usdt(totals['should'])}\n"
+        f"📤 清除前已下发：{fmt_usdt(totals['sent'])}"
+    )
+    await safe_reply_text(update.message, msg)
+    await safe_reply_text(update.message, render_group_summary(chat_id))
+
+
+# ========== 撤销入金（撤销最近一笔入金） ==========
+async def _cmd_undo_in(update: Update, chat_id: int, state: Dict[str, Any], ts: str, dstr: str) -> None:
+    rec_in = state["recent"]["in"]
+    if not rec_in:
+        await safe_reply_text(update.message, "ℹ️ 当前账期暂无入金记录，无需撤销")
+        return
+    last = rec_in.pop(0)
+    await save_group_state_async(chat_id)
+    append_log(
+        log_path(chat_id, last.get("country"), dstr),
+        f"[撤销入金] 时间:{ts} 原始:{last.get('raw')} USDT:{last.get('usdt')} 备注:{last.get('peer','')}",
+    )
+    await safe_reply_text(update.message, f"✅ 已撤销最近一笔入金：{last.get('raw')} → {last.get('usdt')} USDT")
+    await safe_reply_text(update.message, render_group_summary(chat_id))
+
+
+# ========== 撤销出金（撤销最近一笔普通出金） ==========
+async def _cmd_undo_out(update: Update, chat_id: int, state: Dict[str, Any], ts: str, dstr: str) -> None:
+    rec_out = state["recent"]["out"]
+    target_idx = None
+    for idx, r in enumerate(rec_out):
+        if r.get("type") != "下发":
+            target_idx = idx
+            break
+    if target_idx is None:
+        await safe_reply_text(update.message, "ℹ️ 当前账期暂无出金记录，无需撤销")
+        return
+    last = rec_out.pop(target_idx)
+    await save_group_state_async(chat_id)
+    append_log(
+        log_path(chat_id, last.get("country"), dstr),
+        f"[撤销出金] 时间:{ts} 原始:{last.get('raw')} USDT:{last.get('usdt')} 手续费:{last.get('fee_usdt',0)} 备注:{last.get('peer','')}",
+    )
+    await safe_reply_text(update.message, f"✅ 已撤销最近一笔出金：{last.get('raw')} → {last.get('usdt')} USDT")
+    await safe_reply_text(update.message, render_group_summary(chat_id))
+
+
+# ========== 撤销下发（撤销最近一笔下发） ==========
+async def _cmd_undo_send(update: Update, chat_id: int, state: Dict[str, Any], ts: str, dstr: str) -> None:
+    rec_out = state["recent"]["out"]
+    target_idx = None
+    for idx, r in enumerate(rec_out):
+        if r.get("type") == "下发":
+            target_idx = idx
+            break
+    if target_idx is None:
+        await safe_reply_text(update.message, "ℹ️ 当前账期暂无下发记录，无需撤销")
+        return
+    last = rec_out.pop(target_idx)
+    await save_group_state_async(chat_id)
+    append_log(
+        log_path(chat_id, None, dstr),
+        f"[撤销下发] 时间:{ts} USDT:{last.get('usdt')} 备注:{last.get('peer','')}",
+    )
+    await safe_reply_text(update.message, f"✅ 已撤销最近一笔下发记录：{last.get('usdt')} USDT")
+    await safe_reply_text(update.message, render_group_summary(chat_id))
+
+
+# 管理员精确匹配指令：一次 dict 查找代替逐个 if text == ...
+ADMIN_EXACT_COMMANDS: Dict[str, Any] = {
+    **dict.fromkeys(RESET_TIME_QUERY_COMMANDS, _cmd_show_reset_time),
+    **dict.fromkeys(RESET_DEFAULTS_COMMANDS, _cmd_reset_defaults),
+    **dict.fromkeys(CLEAR_DATA_COMMANDS, _cmd_clear_data),
+    "撤销入金": _cmd_undo_in,
+    "撤销出金": _cmd_undo_out,
+    "撤销下发": _cmd_undo_send,
+}
+
+
+# 群内可识别的指令：普通聊天消息用几次字符串判断即可排除，不再加载群状态 / 判断权限
+GROUP_COMMAND_PREFIXES = ("+", "-", "设置", "下发")
+GROUP_EXACT_TEXTS = FULL_SUMMARY_COMMANDS | ADMIN_MANAGE_COMMANDS | frozenset(ADMIN_EXACT_COMMANDS)
+
+
+def is_group_command(text: str) -> bool:
+    return (
+        text.startswith(GROUP_COMMAND_PREFIXES)
+        or text in GROUP_EXACT_TEXTS
+        or text.endswith("当前点位")
+    )
+
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat = update.effective_chat
     chat_id = chat.id
     text = (update.message.text or update.message.caption or "").strip()
-    ts, dstr = now_ts(), today_str()
+    ts, dstr = now_ts_date()
 
     # ========== 私聊转发给第一个超级管理员 ==========
     if chat.type == "private":
-        private_log_dir = LOG_DIR / "private_chats"
-        private_log_dir.mkdir(exist_ok=True)
-        user_log_file = private_log_dir / f"user_{user.id}.log"
+        user_log_file = PRIVATE_LOG_DIR / f"user_{user.id}.log"
 
-        log_entry = f"[{ts}] {user.full_name} (@{user.username or 'N/A'}): {text}\n"
-        with open(user_log_file, "a", encoding="utf-8") as f:
-            f.write(log_entry)
+        log_entry = f"[{ts}] {user.full_name} (@{user.username or 'N/A'}): {text}"
+        append_log(user_log_file, log_entry)
 
         if SUPER_ADMINS:
             main_owner = list(SUPER_ADMINS)[0]
@@ -669,7 +1034,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         context.bot_data["private_msg_map"] = {}
                     context.bot_data["private_msg_map"][sent_msg.message_id] = user.id
 
-                    await update.message.reply_text("✅ 您的消息已发送给客服\n⏳ 请耐心等待回复")
+                    await safe_reply_text(update.message, "✅ 您的消息已发送给客服\n⏳ 请耐心等待回复")
                     return
                 except Exception as e:
                     print(f"转发私聊消息失败: {e}")
@@ -685,21 +1050,22 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                 chat_id=target_user_id,
                                 text=f"💬 客服回复：\n\n{text}",
                             )
-                            await update.message.reply_text("✅ 回复已发送")
-                            target_log_file = private_log_dir / f"user_{target_user_id}.log"
-                            reply_log_entry = f"[{ts}] OWNER回复: {text}\n"
-                            with open(target_log_file, "a", encoding="utf-8") as f:
-                                f.write(reply_log_entry)
+                            await safe_reply_text(update.message, "✅ 回复已发送")
+                            target_log_file = PRIVATE_LOG_DIR / f"user_{target_user_id}.log"
+                            append_log(target_log_file, f"[{ts}] OWNER回复: {text}")
                             return
                         except Exception as e:
-                            await update.message.reply_text(f"❌ 发送失败: {e}")
+                            await safe_reply_text(update.message, f"❌ 发送失败: {e}")
                             return
 
-        await update.message.reply_text("💡 已记录您的消息，如需查看账单请在群里发送 +0。")
+        await safe_reply_text(update.message, "💡 已记录您的消息，如需查看账单请在群里发送 +0。")
         return
 
     # ========== 群组消息处理 ==========
-    check_and_reset_daily(chat_id)
+    if not is_group_command(text):
+        return
+
+    await check_and_reset_daily(chat_id)
     state = load_group_state(chat_id)
 
     # 获取“回复对象名称（前4位）”
@@ -709,20 +1075,20 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 所有人都可查看汇总
     if text == "+0":
-        await update.message.reply_text(render_group_summary(chat_id))
+        await safe_reply_text(update.message, render_group_summary(chat_id))
         return
 
     # 所有人都可看完整记录
-    if text in ["更多记录", "查看更多记录", "更多账单", "显示历史账单"]:
-        await update.message.reply_text(render_full_summary(chat_id))
+    if text in FULL_SUMMARY_COMMANDS:
+        await safe_reply_text(update.message, render_full_summary(chat_id))
         return
 
     # ========== 管理机器人管理员（仅超级管理员） ==========
     # 仅保留：回复用户消息 -> 发送「设置管理员」「删除管理员」
-    if text.strip() in ("设置管理员", "删除管理员", "显示管理员"):
+    if text in ADMIN_MANAGE_COMMANDS:
         admins = list_admins()
 
-        if text.strip() == "显示管理员":
+        if text == "显示管理员":
             lines: List[str] = []
             lines.append("👥 机器人权限列表\n")
 
@@ -759,17 +1125,18 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 lines.append("暂无机器人管理员")
 
-            await update.message.reply_text("\n".join(lines))
+            await safe_reply_text(update.message, "\n".join(lines))
             return
 
         if not can_manage_bot_admin(user.id):
-            await update.message.reply_text("🚫 只有超级管理员可以设置/删除机器人管理员。")
+            await safe_reply_text(update.message, "🚫 只有超级管理员可以设置/删除机器人管理员。")
             return
 
         target = await resolve_target_user_for_admin(update, context)
 
         if not target or getattr(target, "id", None) is None:
-            await update.message.reply_text(
+            await safe_reply_text(
+                update.message,
                 "❌ 请先【回复对方的消息】再发送：设置管理员 或 删除管理员\n"
                 "示例：回复某人一句话 → 发送「设置管理员」"
             )
@@ -786,17 +1153,19 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             fname = getattr(target, "full_name", None) or str(target_id)
             target_mention = f"{fname} (@{uname})" if uname else f"{fname} (ID:{target_id})"
 
-        if text.strip() == "设置管理员":
-            add_admin(target_id)
-            await update.message.reply_text(
+        if text == "设置管理员":
+            await add_admin(target_id)
+            await safe_reply_text(
+                update.message,
                 f"✅ 已将 {target_mention} 设置为机器人管理员。",
                 parse_mode="HTML",
             )
             return
 
-        if text.strip() == "删除管理员":
-            remove_admin(target_id)
-            await update.message.reply_text(
+        if text == "删除管理员":
+            await remove_admin(target_id)
+            await safe_reply_text(
+                update.message,
                 f"🗑️ 已移除 {target_mention} 的机器人管理员权限。",
                 parse_mode="HTML",
             )
@@ -806,65 +1175,133 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_bot_admin(user.id):
         return
 
+    # ========== 入金（记账消息最常见，优先匹配） ==========
+    if text.startswith("+"):
+        amt, country = parse_amount_and_country(text)
+        if amt is None:
+            return
+        p = resolve_params(chat_id, "in", country)
+        if p["fx"] == 0:
+            await safe_reply_text(update.message, "⚠️ 请先设置入金费率和汇率")
+            return
+
+        usdt = trunc2(amt * (1 - p["rate"]) / p["fx"])
+        item = {
+            "ts": ts,
+            "raw": amt,
+            "usdt": usdt,
+            "country": country,
+            "fx": p["fx"],
+            "rate": p["rate"],
+        }
+        if peer4:
+            item["peer"] = peer4
+
+        await push_recent(chat_id, "in", item)
+
+        append_log(
+            log_path(chat_id, country, dstr),
+            f"[入金] 时间:{ts} 国家:{country or '通用'} 原始:{amt} 汇率:{p['fx']} 费率:{p['rate']*100:.4f}% 结果:{usdt} 备注:{peer4}",
+        )
+        await safe_reply_text(update.message, render_group_summary(chat_id))
+        return
+
+    # ========== 出金（+ 可配置手续费） ==========
+    if text.startswith("-"):
+        amt, country = parse_amount_and_country(text)
+        if amt is None:
+            return
+        p = resolve_params(chat_id, "out", country)
+        if p["fx"] == 0:
+            await safe_reply_text(update.message, "⚠️ 请先设置出金费率和汇率")
+            return
+
+        fee_usdt = float(state["defaults"]["out"].get("fee_usdt", 0.0))
+        base_usdt = round2(amt * (1 + p["rate"]) / p["fx"])
+        usdt = round2(base_usdt + fee_usdt) if fee_usdt > 0 else base_usdt
+
+        item = {
+            "ts": ts,
+            "raw": amt,
+            "usdt": usdt,
+            "base_usdt": base_usdt,
+            "fee_usdt": round2(fee_usdt),
+            "country": country,
+            "fx": p["fx"],
+            "rate": p["rate"],
+        }
+        if peer4:
+            item["peer"] = peer4
+
+        await push_recent(chat_id, "out", item)
+
+        append_log(
+            log_path(chat_id, country, dstr),
+            f"[出金] 时间:{ts} 国家:{country or '通用'} 原始:{amt} 汇率:{p['fx']} 费率:{p['rate']*100:.4f}% 基础:{base_usdt} 手续费:{fee_usdt} 合计:{usdt} 备注:{peer4}",
+        )
+        await safe_reply_text(update.message, render_group_summary(chat_id))
+        return
+
+    # ========== 精确匹配指令（撤销 / 清除 / 重置等） ==========
+    handler = ADMIN_EXACT_COMMANDS.get(text)
+    if handler is not None:
+        await handler(update, chat_id, state, ts, dstr)
+        return
+
     # ========== 设置账单名称 ==========
     if text.startswith("设置账单名称"):
         new_name = text.replace("设置账单名称", "", 1).strip()
         if not new_name:
-            await update.message.reply_text("❌ 请输入账单名称，例如：设置账单名称 东启海外支付")
+            await safe_reply_text(update.message, "❌ 请输入账单名称，例如：设置账单名称 东启海外支付")
             return
         state["bot_name"] = new_name
-        save_group_state(chat_id)
-        await update.message.reply_text(f"✅ 账单名称已修改为：{new_name}")
+        await save_group_state_async(chat_id)
+        await safe_reply_text(update.message, f"✅ 账单名称已修改为：{new_name}")
         return
 
     # ========== 设置清空时间（北京时间） ==========
     if text.startswith("设置清空时间"):
         val = text.replace("设置清空时间", "", 1).strip()
-        m = re.match(r"^([01]\d|2[0-3]):([0-5]\d)$", val)
+        m = _HHMM_RE.match(val)
         if not m:
-            await update.message.reply_text("❌ 格式：设置清空时间 HH:MM（例如：设置清空时间 06:00）")
+            await safe_reply_text(update.message, "❌ 格式：设置清空时间 HH:MM（例如：设置清空时间 06:00）")
             return
 
         state["reset_time"] = val
         # 立即对齐当前账期，避免设置后下一条消息误判
         state["last_period"] = _current_period_id(val)
-        save_group_state(chat_id)
+        await save_group_state_async(chat_id)
 
-        await update.message.reply_text(f"✅ 已设置每日清空时间（北京时间）：{val}\n📌 账期长度仍为 24 小时。")
-        await update.message.reply_text(render_group_summary(chat_id))
-        return
-
-    if text.strip() in ("查看清空时间", "当前清空时间"):
-        rt = state.get("reset_time", "00:00")
-        await update.message.reply_text(f"⏰ 当前每日清空时间（北京时间）：{rt}\n📌 账期长度：24 小时。")
+        await safe_reply_text(update.message, f"✅ 已设置每日清空时间（北京时间）：{val}\n📌 账期长度仍为 24 小时。")
+        await safe_reply_text(update.message, render_group_summary(chat_id))
         return
 
     # ========== 设置出金手续费（USDT/笔） ==========
     if text.startswith("设置出金手续费"):
         val_str = text.replace("设置出金手续费", "", 1).strip()
         if not val_str:
-            await update.message.reply_text("❌ 格式：设置出金手续费 1（0关闭）")
+            await safe_reply_text(update.message, "❌ 格式：设置出金手续费 1（0关闭）")
             return
         try:
             fee = float(val_str)
             if fee < 0:
-                await update.message.reply_text("❌ 手续费不能为负数")
+                await safe_reply_text(update.message, "❌ 手续费不能为负数")
                 return
             state["defaults"].setdefault("out", {})
             state["defaults"]["out"]["fee_usdt"] = round2(fee)
-            save_group_state(chat_id)
-            await update.message.reply_text(f"✅ 已设置出金手续费：{round2(fee):.2f} USDT/笔（0为关闭）")
-            await update.message.reply_text(render_group_summary(chat_id))
+            await save_group_state_async(chat_id)
+            await safe_reply_text(update.message, f"✅ 已设置出金手续费：{round2(fee):.2f} USDT/笔（0为关闭）")
+            await safe_reply_text(update.message, render_group_summary(chat_id))
             return
         except ValueError:
-            await update.message.reply_text("❌ 请输入有效数字，例如：设置出金手续费 1 或 设置出金手续费 0")
+            await safe_reply_text(update.message, "❌ 请输入有效数字，例如：设置出金手续费 1 或 设置出金手续费 0")
             return
 
     # ========== 查询国家点位 ==========
     if text.endswith("当前点位"):
         country = text.replace("当前点位", "").strip()
         if not country:
-            await update.message.reply_text("❌ 请指定国家名称，例如：日本当前点位")
+            await safe_reply_text(update.message, "❌ 请指定国家名称，例如：日本当前点位")
             return
 
         countries = state["countries"]
@@ -900,69 +1337,36 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"  • 手续费：{out_fee:.2f} USDT/笔（默认）\n",
             f"⏰ 清空时间（北京时间）：{reset_time}（账期 24 小时）",
         ]
-        await update.message.reply_text("\n".join(lines))
-        return
-
-    # ========== 重置默认值 ==========
-    if text in ("重置默认值", "恢复默认值"):
-        state["defaults"] = {
-            "in": {"rate": 0.10, "fx": 153},
-            "out": {
-                "rate": 0.02,
-                "fx": 137,
-                "fee_usdt": float(state["defaults"]["out"].get("fee_usdt", 0.0)),
-            },
-        }
-        save_group_state(chat_id)
-        await update.message.reply_text(
-            "✅ 已重置为推荐默认值\n\n"
-            "📥 入金设置：费率 10% / 汇率 153\n"
-            "📤 出金设置：费率 2% / 汇率 137\n"
-            f"🧾 出金手续费：{float(state['defaults']['out'].get('fee_usdt', 0.0)):.2f} USDT/笔"
-        )
+        await safe_reply_text(update.message, "\n".join(lines))
         return
 
     # ========== 简单设置默认费率/汇率（支持小数费率） ==========
-    if text.startswith(("设置入金费率", "设置入金汇率", "设置出金费率", "设置出金汇率")):
+    simple_setting = SIMPLE_SETTING_COMMANDS.get(text[:6])
+    if simple_setting:
         try:
-            direction = ""
-            key = ""
-            val = 0.0
-            display_val = ""
-
-            if text.startswith("设置入金费率"):
-                direction, key = "in", "rate"
-                val = float(text.replace("设置入金费率", "", 1).strip()) / 100.0
+            direction, key = simple_setting
+            val = float(text[6:].strip())
+            if key == "rate":
+                val /= 100.0
                 display_val = fmt_rate_percent(val)
-            elif text.startswith("设置入金汇率"):
-                direction, key = "in", "fx"
-                val = float(text.replace("设置入金汇率", "", 1).strip())
-                display_val = str(val)
-            elif text.startswith("设置出金费率"):
-                direction, key = "out", "rate"
-                val = float(text.replace("设置出金费率", "", 1).strip()) / 100.0
-                display_val = fmt_rate_percent(val)
-            elif text.startswith("设置出金汇率"):
-                direction, key = "out", "fx"
-                val = float(text.replace("设置出金汇率", "", 1).strip())
+            else:
                 display_val = str(val)
 
             state["defaults"].setdefault(direction, {})
             state["defaults"][direction][key] = val
-            save_group_state(chat_id)
+            await save_group_state_async(chat_id)
 
             type_name = "费率" if key == "rate" else "汇率"
             dir_name = "入金" if direction == "in" else "出金"
-            await update.message.reply_text(f"✅ 已设置默认{dir_name}{type_name}\n📊 新值：{display_val}")
+            await safe_reply_text(update.message, f"✅ 已设置默认{dir_name}{type_name}\n📊 新值：{display_val}")
             return
         except ValueError:
-            await update.message.reply_text("❌ 格式错误，请输入有效的数字\n例如：设置入金费率 3.5")
+            await safe_reply_text(update.message, "❌ 格式错误，请输入有效的数字\n例如：设置入金费率 3.5")
             return
 
     # ========== 高级设置（指定国家）（费率支持小数） ==========
     if text.startswith("设置") and not text.startswith(("设置入金", "设置出金", "设置账单名称", "设置出金手续费", "设置清空时间")):
-        pattern = r"^设置\s*(.+?)(入|出)(费率|汇率)\s*(\d+(?:\.\d+)?)\s*$"
-        match = re.match(pattern, text)
+        match = _SCOPE_SETTING_RE.match(text)
         if match:
             scope = match.group(1).strip()
             direction = "in" if match.group(2) == "入" else "out"
@@ -978,170 +1382,22 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 else:
                     state["countries"].setdefault(scope, {}).setdefault(direction, {})[key] = val
 
-                save_group_state(chat_id)
+                await save_group_state_async(chat_id)
 
                 type_name = "费率" if key == "rate" else "汇率"
                 dir_name = "入金" if direction == "in" else "出金"
                 display_val = fmt_rate_percent(val) if key == "rate" else str(val)
-                await update.message.reply_text(f"✅ 已设置 {scope} {dir_name}{type_name}\n📊 新值：{display_val}")
+                await safe_reply_text(update.message, f"✅ 已设置 {scope} {dir_name}{type_name}\n📊 新值：{display_val}")
                 return
             except ValueError:
-                await update.message.reply_text("❌ 数值格式错误")
+                await safe_reply_text(update.message, "❌ 数值格式错误")
                 return
 
-    # ========== 清空今日数据 ==========
-    if text in ("清除数据", "清空数据", "清楚数据", "清除账单", "清空账单"):
-        totals = compute_totals(state)
-        in_count = len(state["recent"]["in"])
-        out_count = len(state["recent"]["out"])
-
-        state["recent"]["in"] = []
-        state["recent"]["out"] = []
-        state["summary"]["should_send_usdt"] = 0.0
-        state["summary"]["sent_usdt"] = 0.0
-        save_group_state(chat_id)
-
-        msg = (
-            "✅ 已清除当前账期所有数据\n\n"
-            f"📥 入金记录：{in_count} 笔\n"
-            f"📤 出金 + 下发记录：{out_count} 笔\n"
-            f"🧾 清除前应下发：{fmt_usdt(totals['should'])}\n"
-            f"📤 清除前已下发：{fmt_usdt(totals['sent'])}"
-        )
-        await update.message.reply_text(msg)
-        await update.message.reply_text(render_group_summary(chat_id))
-        return
-
-    # ========== 撤销入金（撤销最近一笔入金） ==========
-    if text == "撤销入金":
-        rec_in = state["recent"]["in"]
-        if not rec_in:
-            await update.message.reply_text("ℹ️ 当前账期暂无入金记录，无需撤销")
-            return
-        last = rec_in.pop(0)
-        save_group_state(chat_id)
-        append_log(
-            log_path(chat_id, last.get("country"), dstr),
-            f"[撤销入金] 时间:{ts} 原始:{last.get('raw')} USDT:{last.get('usdt')} 备注:{last.get('peer','')}",
-        )
-        await update.message.reply_text(f"✅ 已撤销最近一笔入金：{last.get('raw')} → {last.get('usdt')} USDT")
-        await update.message.reply_text(render_group_summary(chat_id))
-        return
-
-    # ========== 撤销出金（撤销最近一笔普通出金） ==========
-    if text == "撤销出金":
-        rec_out = state["recent"]["out"]
-        target_idx = None
-        for idx, r in enumerate(rec_out):
-            if r.get("type") != "下发":
-                target_idx = idx
-                break
-        if target_idx is None:
-            await update.message.reply_text("ℹ️ 当前账期暂无出金记录，无需撤销")
-            return
-        last = rec_out.pop(target_idx)
-        save_group_state(chat_id)
-        append_log(
-            log_path(chat_id, last.get("country"), dstr),
-            f"[撤销出金] 时间:{ts} 原始:{last.get('raw')} USDT:{last.get('usdt')} 手续费:{last.get('fee_usdt',0)} 备注:{last.get('peer','')}",
-        )
-        await update.message.reply_text(f"✅ 已撤销最近一笔出金：{last.get('raw')} → {last.get('usdt')} USDT")
-        await update.message.reply_text(render_group_summary(chat_id))
-        return
-
-    # ========== 撤销下发（撤销最近一笔下发） ==========
-    if text == "撤销下发":
-        rec_out = state["recent"]["out"]
-        target_idx = None
-        for idx, r in enumerate(rec_out):
-            if r.get("type") == "下发":
-                target_idx = idx
-                break
-        if target_idx is None:
-            await update.message.reply_text("ℹ️ 当前账期暂无下发记录，无需撤销")
-            return
-        last = rec_out.pop(target_idx)
-        save_group_state(chat_id)
-        append_log(
-            log_path(chat_id, None, dstr),
-            f"[撤销下发] 时间:{ts} USDT:{last.get('usdt')} 备注:{last.get('peer','')}",
-        )
-        await update.message.reply_text(f"✅ 已撤销最近一笔下发记录：{last.get('usdt')} USDT")
-        await update.message.reply_text(render_group_summary(chat_id))
-        return
-
-    # ========== 入金 ==========
-    if text.startswith("+"):
-        amt, country = parse_amount_and_country(text)
-        if amt is None:
-            return
-        p = resolve_params(chat_id, "in", country)
-        if p["fx"] == 0:
-            await update.message.reply_text("⚠️ 请先设置入金费率和汇率")
-            return
-
-        usdt = trunc2(amt * (1 - p["rate"]) / p["fx"])
-        item = {
-            "ts": ts,
-            "raw": amt,
-            "usdt": usdt,
-            "country": country,
-            "fx": p["fx"],
-            "rate": p["rate"],
-        }
-        if peer4:
-            item["peer"] = peer4
-
-        push_recent(chat_id, "in", item)
-
-        append_log(
-            log_path(chat_id, country, dstr),
-            f"[入金] 时间:{ts} 国家:{country or '通用'} 原始:{amt} 汇率:{p['fx']} 费率:{p['rate']*100:.4f}% 结果:{usdt} 备注:{peer4}",
-        )
-        await update.message.reply_text(render_group_summary(chat_id))
-        return
-
-    # ========== 出金（+ 可配置手续费） ==========
-    if text.startswith("-"):
-        amt, country = parse_amount_and_country(text)
-        if amt is None:
-            return
-        p = resolve_params(chat_id, "out", country)
-        if p["fx"] == 0:
-            await update.message.reply_text("⚠️ 请先设置出金费率和汇率")
-            return
-
-        fee_usdt = float(state["defaults"]["out"].get("fee_usdt", 0.0))
-        base_usdt = round2(amt * (1 + p["rate"]) / p["fx"])
-        usdt = round2(base_usdt + fee_usdt) if fee_usdt > 0 else base_usdt
-
-        item = {
-            "ts": ts,
-            "raw": amt,
-            "usdt": usdt,
-            "base_usdt": base_usdt,
-            "fee_usdt": round2(fee_usdt),
-            "country": country,
-            "fx": p["fx"],
-            "rate": p["rate"],
-        }
-        if peer4:
-            item["peer"] = peer4
-
-        push_recent(chat_id, "out", item)
-
-        append_log(
-            log_path(chat_id, country, dstr),
-            f"[出金] 时间:{ts} 国家:{country or '通用'} 原始:{amt} 汇率:{p['fx']} 费率:{p['rate']*100:.4f}% 基础:{base_usdt} 手续费:{fee_usdt} 合计:{usdt} 备注:{peer4}",
-        )
-        await update.message.reply_text(render_group_summary(chat_id))
-        return
-
     # ========== 下发记录（保留正负，且展示时原样显示） ==========
     if text.startswith("下发"):
         usdt_str = text.replace("下发", "", 1).strip()
         if not usdt_str:
-            await update.message.reply_text("❌ 格式：下发100 或 下发-100")
+            await safe_reply_text(update.message, "❌ 格式：下发100 或 下发-100")
             return
         try:
             usdt = trunc2(float(usdt_str))  # 保留正负
@@ -1149,15 +1405,15 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if peer4:
                 item["peer"] = peer4
 
-            push_recent(chat_id, "out", item)
+            await push_recent(chat_id, "out", item)
             append_log(
                 log_path(chat_id, None, dstr),
                 f"[下发] 时间:{ts} 金额:{usdt} 备注:{peer4}",
             )
-            await update.message.reply_text(render_group_summary(chat_id))
+            await safe_reply_text(update.message, render_group_summary(chat_id))
             return
         except ValueError:
-            await update.message.reply_text("❌ 格式错误，请输入有效数字，例如：下发100 或 下发-100")
+            await safe_reply_text(update.message, "❌ 格式错误，请输入有效数字，例如：下发100 或 下发-100")
             return
 
     # 其他消息忽略
@@ -1165,50 +1421,117 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ========== HTTP 健康检查 ==========
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path in ["/", "/health"]:
-            self.send_response(200)
-            self.send_header("Content-type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"OK")
-        else:
-            self.send_response(404)
-            self.end_headers()
+# 直接跑在 Bot 的事件循环上（asyncio.start_server），不再单独开线程
+HEALTH_PATHS = ("/", "/health")
+_health_server: Optional[asyncio.AbstractServer] = None
 
-    def log_message(self, format, *args):
+
+async def handle_health_check(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # 读掉请求头
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if line in (b"\r\n", b"\n", b""):
+                break
+        parts = request_line.split()
+        path = parts[1].decode("latin-1") if len(parts) > 1 else ""
+        if path in HEALTH_PATHS:
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-type: text/plain\r\n"
+                b"Content-Length: 2\r\nConnection: close\r\n\r\nOK"
+            )
+        else:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+    except (asyncio.TimeoutError, ValueError, ConnectionError, asyncio.IncompleteReadError):
+        # 超时、请求行/请求头超长（ValueError）、连接中断：直接断开，不产生未处理异常
         pass
+    finally:
+        writer.close()
+
+
+async def start_health_server() -> None:
+    global _health_server
+    port = int(os.getenv("PORT", "10000"))
+    try:
+        _health_server = await asyncio.start_server(handle_health_check, "0.0.0.0", port)
+    except OSError as e:
+        # 端口被占用等：只影响健康检查，机器人照常运行
+        print(f"⚠️ HTTP 健康检查服务器启动失败（端口 {port}）: {e}")
+        return
+    print(f"✅ HTTP 服务器已启动: http://0.0.0.0:{port}")
+
+
+async def stop_health_server(application) -> None:
+    if _health_server is not None:
+        _health_server.close()
+        await _health_server.wait_closed()
+
+
+async def on_startup(application) -> None:
+    await start_flusher()
+
+
+async def on_shutdown(application) -> None:
+    await stop_flusher()
+    await stop_health_server(application)
+
+
+# ========== 单实例锁 ==========
+# 同一数据目录只允许一个轮询进程，避免多个实例重复拉取更新、重复写账
+_instance_lock_fd: Optional[int] = None
+
+
+def acquire_instance_lock() -> bool:
+    global _instance_lock_fd
+    if fcntl is None:
+        return True
+    fd = os.open(DATA_DIR / ".bot.lock", os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    _instance_lock_fd = fd
+    return True
 
 
 # ========== 初始化 ==========
+_BANNER = "=" * 50
+
+
 def init_bot():
-    print("=" * 50)
+    print(_BANNER)
     print("🚀 正在启动财务记账机器人...")
-    print("=" * 50)
+    print(_BANNER)
 
     if not BOT_TOKEN:
         print("❌ 错误：未找到 TELEGRAM_BOT_TOKEN 环境变量")
         exit(1)
 
+    if not acquire_instance_lock():
+        print("❌ 错误：已有机器人实例在运行（同一数据目录），本进程退出")
+        exit(1)
+
     print("✅ Bot Token 已加载")
     print(f"📊 数据目录: {DATA_DIR}")
     print(
         f"⭐ 超级管理员列表: {', '.join(str(i) for i in sorted(SUPER_ADMINS)) or '未设置（请配置 OWNER_ID / SUPER_ADMINS）'}"
     )
 
-    port = int(os.getenv("PORT", "10000"))
-    print(f"\n🌐 启动 HTTP 健康检查服务器（端口 {port}）...")
-
-    def run_http_server():
-        server = HTTPServer(("0.0.0.0", port), HealthCheckHandler)
-        print(f"✅ HTTP 服务器已启动: http://0.0.0.0:{port}")
-        server.serve_forever()
-
-    http_thread = threading.Thread(target=run_http_server, daemon=True)
-    http_thread.start()
-
     print("\n🤖 配置 Telegram Bot (Polling 模式)...")
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    # 出站请求连接池：默认只有 1 个连接，多条 reply_text 会互相排队
+    application = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .connection_pool_size(32)
+        .connect_timeout(5)
+        .read_timeout(20)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     application.add_handler(CommandHandler("start", cmd_start))
     application.add_handler(
         MessageHandler(
@@ -1218,7 +1541,15 @@ def init_bot():
     )
     print("✅ Bot 处理器已注册")
     print("\n🎉 机器人正在运行，等待消息...")
-    print("=" * 50)
+    print(_BANNER)
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        print("⚡ 已启用 uvloop 事件循环")
+    # 健康检查端口在连接 Telegram（initialize / getMe）之前绑定：API 响应慢时平台的端口检测也能通过。
+    # run_polling 沿用这里设置的事件循环，健康检查服务器和 Bot 跑在同一个循环上
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(start_health_server())
     application.run_polling()
 
 
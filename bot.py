@@ -1,13 +1,30 @@
 # bot.py
 import os
 import re
-import threading
+import asyncio
+import random
 import json
 import math
 import datetime
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
-from http.server import HTTPServer, BaseHTTPRequestHandler
+
+try:
+    import fcntl
+except ImportError:  # Windows 本地调试没有 fcntl
+    fcntl = None
+
+try:
+    import uvloop  # 可选：libuv 事件循环，回调与 socket 开销更低
+except ImportError:
+    uvloop = None
+
+try:
+    import orjson  # 可选：C 实现的 JSON 库，群组状态文件读写优先使用
+except ImportError:
+    orjson = None
 
 import requests  # 当前没有用到，用于以后需要时保留
 
@@ -15,16 +32,22 @@ import requests  # 当前没有用到，用于以后需要时保留
 load_dotenv()
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 OWNER_ID = os.getenv("OWNER_ID")  # 可选：你的 Telegram ID（字符串），拥有永久管理员权限
+# 启动时解析一次，后续权限判断直接比较整数
+OWNER_ID_INT: int | None = (
+    int(OWNER_ID.strip()) if OWNER_ID and OWNER_ID.strip().isdigit() else None
+)
 
 # ========== 记账核心状态（多群组支持）==========
 DATA_DIR = Path("./data")
 GROUPS_DIR = DATA_DIR / "groups"
 LOG_DIR = DATA_DIR / "logs"
+PRIVATE_LOG_DIR = LOG_DIR / "private_chats"
 ADMINS_FILE = DATA_DIR / "admins.json"
 
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 GROUPS_DIR.mkdir(parents=True, exist_ok=True)
 LOG_DIR.mkdir(parents=True, exist_ok=True)
+PRIVATE_LOG_DIR.mkdir(parents=True, exist_ok=True)
 
 # 群组状态缓存 {chat_id: state_dict}
 groups_state: dict[int, dict] = {}
@@ -61,8 +84,7 @@ def load_group_state(chat_id: int) -> dict:
     file_path = group_file_path(chat_id)
     if file_path.exists():
         try:
-            with file_path.open("r", encoding="utf-8") as f:
-                state = json.load(f)
+            state = _load_json(file_path.read_bytes())
             # 兼容老数据，补齐字段
             state.setdefault("recent", {"in": [], "out": []})
             state.setdefault("summary", {"should_send_usdt": 0.0, "sent_usdt": 0.0})
@@ -83,24 +105,59 @@ def load_group_state(chat_id: int) -> dict:
 
     # 创建新群组状态
     state = get_default_state()
+    # 只放进缓存，不在读取路径上写盘；首次修改时才落文件
     groups_state[chat_id] = state
-    save_group_state(chat_id)
     return state
 
 
-def save_group_state(chat_id: int):
-    """保存群组状态到JSON文件"""
-    if chat_id not in groups_state:
-        return
+# 输出格式与 json.dumps(ensure_ascii=False, indent=2) 一致（UTF-8 原文、两格缩进）
+if orjson is not None:
+    def _dump_state(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
 
-    file_path = group_file_path(chat_id)
+    _load_json = orjson.loads
+else:
+    def _dump_state(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+    _load_json = json.loads
+
+
+# 磁盘写入线程：handler 里不做同步文件 I/O，事件循环可以继续收发消息。
+# 只用一个线程，保证同一文件的多次写入按提交顺序完成（旧快照不会覆盖新快照）
+_io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bot-io")
+
+
+async def _run_io(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_io_executor, fn, *args)
+
+
+def _write_state_file(file_path: Path, payload: bytes):
+    # 先写临时文件再原子替换，Web 查账同时读取时不会读到写了一半的 JSON。
+    # 临时文件用 mkstemp 创建：Bot、Web 和多个 gunicorn worker 同时写同一文件时各用各的临时文件
+    tmp_path = None
     try:
-        with file_path.open("w", encoding="utf-8") as f:
-            json.dump(groups_state[chat_id], f, ensure_ascii=False, indent=2)
+        fd, tmp_name = tempfile.mkstemp(dir=file_path.parent, prefix=f"{file_path.name}.", suffix=".tmp")
+        tmp_path = Path(tmp_name)
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        # mkstemp 创建的文件是 0600，改回普通数据文件的权限
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
     except Exception as e:
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
         print(f"❌ 保存群组状态文件失败: {e}")
 
 
+async def save_group_state_async(chat_id: int):
+    """保存群组状态到JSON文件（序列化在事件循环里做，写盘交给 I/O 线程）"""
+    if chat_id not in groups_state:
+        return
+    payload = _dump_state(groups_state[chat_id])
+    await _run_io(_write_state_file, group_file_path(chat_id), payload)
+
+
 # 管理员缓存（从JSON文件加载）
 admins_cache: list[int] | None = None
 
@@ -122,48 +179,76 @@ def load_admins() -> list[int]:
 
     # 初始化管理员（如果有OWNER_ID）
     admins_cache = []
-    if OWNER_ID and OWNER_ID.isdigit():
-        admins_cache.append(int(OWNER_ID))
-    save_admins(admins_cache)
+    if OWNER_ID_INT is not None:
+        admins_cache.append(OWNER_ID_INT)
     return admins_cache
 
 
-def save_admins(admin_list: list[int]):
-    """保存管理员列表到JSON文件"""
-    global admins_cache
-    admins_cache = admin_list
+# 管理员 ID 集合：权限判断走 O(1) 查找；save_admins 时失效
+admin_ids_cache: set[int] | None = None
+
+
+def admin_id_set() -> set[int]:
+    global admin_ids_cache
+    if admin_ids_cache is None:
+        admin_ids_cache = set(load_admins())
+    return admin_ids_cache
+
+
+def _write_admins_file(payload: bytes):
     try:
-        with ADMINS_FILE.open("w", encoding="utf-8") as f:
-            json.dump({"admins": admin_list}, f, ensure_ascii=False, indent=2)
+        ADMINS_FILE.write_bytes(payload)
     except Exception as e:
         print(f"❌ 保存管理员文件失败: {e}")
 
 
-def add_admin(user_id: int) -> bool:
+async def save_admins(admin_list: list[int]):
+    """保存管理员列表到JSON文件（缓存立即更新，写盘交给 I/O 线程）"""
+    global admins_cache, admin_ids_cache
+    admins_cache = admin_list
+    admin_ids_cache = None
+    await _run_io(_write_admins_file, _dump_state({"admins": admin_list}))
+
+
+async def add_admin(user_id: int) -> bool:
     """添加管理员"""
+    if user_id in admin_id_set():
+        return False
     admins = load_admins()
-    if user_id not in admins:
-        admins.append(user_id)
-        save_admins(admins)
-        return True
-    return False
+    admins.append(user_id)
+    await save_admins(admins)
+    return True
 
 
-def remove_admin(user_id: int) -> bool:
+async def remove_admin(user_id: int) -> bool:
     """移除管理员"""
+    if user_id not in admin_id_set():
+        return False
     admins = load_admins()
-    if user_id in admins:
-        admins.remove(user_id)
-        save_admins(admins)
-        return True
-    return False
+    admins.remove(user_id)
+    await save_admins(admins)
+    return True
 
 
 # ========== 工具函数 ==========
+# 热路径正则模块级预编译
+_AMOUNT_RE = re.compile(r"^[\+\-]\s*([0-9]+(?:\.[0-9]+)?)\s*([万千kKwW]?)")
+_COUNTRY_RE = re.compile(r"/\s*([^\s]+)$")
+_UNIT_MULTIPLIERS = {"千": 1000, "k": 1000, "K": 1000, "万": 10000, "w": 10000, "W": 10000}
+# 简单设置命令：6 字前缀 -> (方向, 字段)
+SIMPLE_SETTING_COMMANDS = {
+    "设置入金费率": ("in", "rate"),
+    "设置入金汇率": ("in", "fx"),
+    "设置出金费率": ("out", "rate"),
+    "设置出金汇率": ("out", "fx"),
+}
+_SCOPE_SETTING_RE = re.compile(r"^设置\s*(.+?)(入|出)(费率|汇率)\s*(\d+(?:\.\d+)?)\s*$")
+
+
 def trunc2(x: float) -> float:
     """截断到两位小数（入金 & 汇总用）"""
-    rounded = round(float(x), 6)
-    return math.floor(rounded * 100.0) / 100.0
+    # +5e-5 相当于先按 6 位小数取整：吸收 x*100 的浮点误差（如 2538.68*100 = 253867.99999999997）
+    return math.floor(x * 100.0 + 5e-5) / 100.0
 
 
 def round2(x: float) -> float:
@@ -175,37 +260,34 @@ def fmt_usdt(x: float) -> str:
     return f"{x:.2f} USDT"
 
 
+# 上标转换表（模块加载时构建一次）
+_SUPERSCRIPT_TABLE = str.maketrans("0123456789-", "⁰¹²³⁴⁵⁶⁷⁸⁹⁻")
+
+
 def to_superscript(num: int) -> str:
     """将数字转换为上标，用于显示费率"""
-    superscript_map = {
-        "0": "⁰",
-        "1": "¹",
-        "2": "²",
-        "3": "³",
-        "4": "⁴",
-        "5": "⁵",
-        "6": "⁶",
-        "7": "⁷",
-        "8": "⁸",
-        "9": "⁹",
-        "-": "⁻",
-    }
-    return "".join(superscript_map.get(c, c) for c in str(num))
+    return str(num).translate(_SUPERSCRIPT_TABLE)
+
+
+# 北京时间（UTC+8，无夏令时），模块级只构造一次
+BEIJING_TZ = datetime.timezone(datetime.timedelta(hours=8))
 
 
 def now_ts() -> str:
-    # 使用北京时间（UTC+8）
-    beijing_tz = datetime.timezone(datetime.timedelta(hours=8))
-    return datetime.datetime.now(beijing_tz).strftime("%H:%M")
+    return datetime.datetime.now(BEIJING_TZ).strftime("%H:%M")
 
 
 def today_str() -> str:
-    # 使用北京时间（UTC+8）
-    beijing_tz = datetime.timezone(datetime.timedelta(hours=8))
-    return datetime.datetime.now(beijing_tz).strftime("%Y-%m-%d")
+    return datetime.datetime.now(BEIJING_TZ).strftime("%Y-%m-%d")
+
+
+def now_ts_date() -> tuple[str, str]:
+    """(HH:MM, YYYY-MM-DD)：一次取时间同时得到两者，handler 入口用"""
+    now = datetime.datetime.now(BEIJING_TZ)
+    return now.strftime("%H:%M"), now.strftime("%Y-%m-%d")
 
 
-def check_and_reset_daily(chat_id: int) -> bool:
+async def check_and_reset_daily(chat_id: int) -> bool:
     """检查日期，如果日期变了（过了0点），清空账单"""
     state = load_group_state(chat_id)
     current_date = today_str()
@@ -218,37 +300,115 @@ def check_and_reset_daily(chat_id: int) -> bool:
         state["summary"]["should_send_usdt"] = 0.0
         state["summary"]["sent_usdt"] = 0.0
         state["last_date"] = current_date
-        save_group_state(chat_id)
+        await save_group_state_async(chat_id)
         return True
     elif not last_date:
         # 首次运行，设置日期
         state["last_date"] = current_date
-        save_group_state(chat_id)
+        await save_group_state_async(chat_id)
 
     return False
 
 
+# 已创建的日志目录缓存 {(chat_id, country): Path}，避免每条记账都 mkdir
+_log_dir_cache: dict[tuple[int, str | None], Path] = {}
+
+
 def log_path(chat_id: int, country: str | None, date_str: str) -> Path:
-    folder = f"group_{chat_id}"
-    if country:
-        folder = f"{folder}/{country}"
-    else:
-        folder = f"{folder}/通用"
-    p = LOG_DIR / folder
-    p.mkdir(parents=True, exist_ok=True)
+    key = (chat_id, country)
+    p = _log_dir_cache.get(key)
+    if p is None:
+        folder = f"group_{chat_id}"
+        if country:
+            folder = f"{folder}/{country}"
+        else:
+            folder = f"{folder}/通用"
+        p = LOG_DIR / folder
+        p.mkdir(parents=True, exist_ok=True)
+        _log_dir_cache[key] = p
     return p / f"{date_str}.log"
 
 
-def append_log(path: Path, text: str):
+# 账单日志后台批量落盘：处理消息时只追加到内存并唤醒后台任务，后台任务再等一个周期后
+# 把同一文件积累的多行一次写入（每个文件只 open/write 一次）
+FLUSH_INTERVAL = 0.05
+_pending_logs: dict[Path, list[str]] = {}
+_flush_task: asyncio.Task | None = None
+_flush_stop: asyncio.Event | None = None
+# 有待写日志时置位；空闲时后台任务只等待这个事件，不做定时轮询
+_flush_wake: asyncio.Event | None = None
+
+
+def _write_log_lines(path: Path, lines: list[str]):
     with path.open("a", encoding="utf-8") as f:
-        f.write(text.strip() + "\n")
+        f.write("".join(lines))
+
+
+def append_log(path: Path, text: str):
+    line = text.strip() + "\n"
+    if _flush_task is None:
+        # 后台任务未启动（脚本/调试场景）时直接写
+        _write_log_lines(path, [line])
+        return
+    _pending_logs.setdefault(path, []).append(line)
+    _flush_wake.set()
+
+
+def _write_log_batch(batch: dict[Path, list[str]]):
+    for path, lines in batch.items():
+        try:
+            _write_log_lines(path, lines)
+        except Exception as e:
+            print(f"❌ 写入账单日志失败: {e}")
+
+
+async def flush_logs():
+    global _pending_logs
+    if not _pending_logs:
+        return
+    # 换出待写队列在事件循环里做（handler 不会同时追加），写文件交给 I/O 线程
+    batch, _pending_logs = _pending_logs, {}
+    await _run_io(_write_log_batch, batch)
+
+
+async def _flusher():
+    while True:
+        await _flush_wake.wait()
+        if not _flush_stop.is_set():
+            # 防抖：唤醒后再等一个周期，把这段时间内追加的日志合并成一次写入
+            await asyncio.sleep(FLUSH_INTERVAL)
+        _flush_wake.clear()
+        # 单次写入出错只记录日志：任务必须继续运行，否则之后的日志只进队列、永远不会写盘
+        try:
+            await flush_logs()
+        except Exception as e:
+            print(f"❌ 后台写入账单日志失败: {e}")
+        if _flush_stop.is_set():
+            return
+
+
+async def start_flusher():
+    global _flush_task, _flush_stop, _flush_wake
+    _flush_stop = asyncio.Event()
+    _flush_wake = asyncio.Event()
+    _flush_task = asyncio.create_task(_flusher())
+
+
+async def stop_flusher():
+    """停止后台任务；任务退出前会把剩余日志全部写完"""
+    global _flush_task
+    if _flush_task is not None:
+        _flush_stop.set()
+        _flush_wake.set()
+        await _flush_task
+        _flush_task = None
 
 
 def push_recent(chat_id: int, kind: str, item: dict):
+    # 只改内存，不落盘：调用方改完 summary 后统一保存一次
     state = load_group_state(chat_id)
     arr = state["recent"][kind]
     arr.insert(0, item)  # 最新的放在前面
-    save_group_state(chat_id)
 
 
 def resolve_params(chat_id: int, direction: str, country: str | None) -> dict:
@@ -280,30 +440,32 @@ def parse_amount_and_country(text: str):
       +1万 / 日本
     """
     s = text.strip()
+    # 首字符不是 +/- 直接返回，不进正则
+    if s[:1] not in ("+", "-"):
+        return None, None
     # 先拿金额 + 单位（千/万/k/w）
-    m = re.match(r"^[\+\-]\s*([0-9]+(?:\.[0-9]+)?)\s*([万千kKwW]?)", s)
+    m = _AMOUNT_RE.match(s)
     if not m:
         return None, None
     amount = float(m.group(1))
     unit = m.group(2)
 
-    if unit in ("千", "k", "K"):
-        amount *= 1000
-    elif unit in ("万", "w", "W"):
-        amount *= 10000
+    mult = _UNIT_MULTIPLIERS.get(unit)
+    if mult is not None:
+        amount *= mult
 
     # 再解析 / 国家
-    m2 = re.search(r"/\s*([^\s]+)$", s)
+    # 绝大多数记账消息不带国家，没有 "/" 时跳过正则
+    m2 = _COUNTRY_RE.search(s) if "/" in s else None
     country = m2.group(1) if m2 else None
     return amount, country
 
 
 # ========== 管理员系统 ==========
 def is_admin(user_id: int) -> bool:
-    if OWNER_ID and OWNER_ID.isdigit() and int(OWNER_ID) == user_id:
+    if user_id == OWNER_ID_INT:
         return True
-    admin_list = load_admins()
-    return user_id in admin_list
+    return user_id in admin_id_set()
 
 
 def list_admins() -> list[int]:
@@ -312,74 +474,38 @@ def list_admins() -> list[int]:
 
 
 # ========== 群内汇总显示 ==========
-def render_group_summary(chat_id: int) -> str:
-    state = load_group_state(chat_id)
-    bot = state["bot_name"]
-    rec_in, rec_out = state["recent"]["in"], state["recent"]["out"]
-    should, sent = trunc2(state["summary"]["should_send_usdt"]), trunc2(
-        state["summary"]["sent_usdt"]
+def render_summary_footer(rin, fin, rout, fout, should: float, sent: float, diff: float) -> str:
+    """账单底部（费率/汇率/应下发/已下发/未下发），两种账单共用"""
+    return (
+        "━━━━━━━━━━━━━━\n"
+        f"⚙️ 当前费率：入 {rin * 100:.0f}% ⇄ 出 {abs(rout) * 100:.0f}%\n"
+        f"💱 固定汇率：入 {fin} ⇄ 出 {fout}\n"
+        f"📊 应下发：{fmt_usdt(should)}\n"
+        f"📤 已下发：{fmt_usdt(sent)}\n"
+        f"{'❗' if diff != 0 else '✅'} 未下发：{fmt_usdt(diff)}\n"
+        "━━━━━━━━━━━━━━"
     )
-    diff = trunc2(should - sent)
-    rin, fin = state["defaults"]["in"]["rate"], state["defaults"]["in"]["fx"]
-    rout, fout = state["defaults"]["out"]["rate"], state["defaults"]["out"]["fx"]
 
-    lines: list[str] = []
-    lines.append(f"【{bot} 账单汇总】\n")
 
-    # 分离出金记录中的"下发"和普通出金
-    normal_out = [r for r in rec_out if r.get("type") != "下发"]
-    send_out = [r for r in rec_out if r.get("type") == "下发"]
+def _render_in_line(r: dict, fin, rin) -> str:
+    # 入金（截断）
+    rate_sup = to_superscript(int(r.get("rate", rin) * 100))
+    return f"{r['ts']} {r.get('raw', 0)}  {rate_sup}/ {r.get('fx', fin)} = {trunc2(r['usdt'])}"
 
-    # 入金记录（仍使用截断）
-    lines.append(f"已入账 ({len(rec_in)}笔)")
-    if rec_in:
-        for r in rec_in[:5]:
-            raw = r.get("raw", 0)
-            fx = r.get("fx", fin)
-            rate = r.get("rate", rin)
-            usdt = trunc2(r["usdt"])
-            rate_percent = int(rate * 100)
-            rate_sup = to_superscript(rate_percent)
-            lines.append(f"{r['ts']} {raw}  {rate_sup}/ {fx} = {usdt}")
-
-    lines.append("")
-
-    # 出金记录（四舍五入）
-    lines.append(f"已出账 ({len(normal_out)}笔)")
-    if normal_out:
-        for r in normal_out[:5]:
-            if "raw" in r:
-                raw = r.get("raw", 0)
-                fx = r.get("fx", fout)
-                rate = r.get("rate", rout)
-                usdt = round2(r["usdt"])
-                rate_percent = int(rate * 100)
-                rate_sup = to_superscript(rate_percent)
-                lines.append(f"{r['ts']} {raw}  {rate_sup}/ {fx} = {usdt}")
-
-    lines.append("")
-
-    # 下发记录（保持截断展示）
-    if send_out:
-        lines.append(f"已下发 ({len(send_out)}笔)")
-        for r in send_out[:5]:
-            usdt = trunc2(abs(r["usdt"]))
-            lines.append(f"{r['ts']} {usdt}")
-        lines.append("")
-
-    lines.append("━━━━━━━━━━━━━━")
-    lines.append(f"⚙️ 当前费率：入 {rin * 100:.0f}% ⇄ 出 {abs(rout) * 100:.0f}%")
-    lines.append(f"💱 固定汇率：入 {fin} ⇄ 出 {fout}")
-    lines.append(f"📊 应下发：{fmt_usdt(should)}")
-    lines.append(f"📤 已下发：{fmt_usdt(sent)}")
-    lines.append(f"{'❗' if diff != 0 else '✅'} 未下发：{fmt_usdt(diff)}")
-    lines.append("━━━━━━━━━━━━━━")
-    lines.append("📚 **查看更多记录**：发送「更多记录」")
-    return "\n".join(lines)
 
+def _render_out_line(r: dict, fout, rout) -> str:
+    # 出金（四舍五入）
+    rate_sup = to_superscript(int(r.get("rate", rout) * 100))
+    return f"{r['ts']} {r.get('raw', 0)}  {rate_sup}/ {r.get('fx', fout)} = {round2(r['usdt'])}"
 
-def render_full_summary(chat_id: int) -> str:
-    """显示当天所有记录"""
+
+def _render_send_line(r: dict) -> str:
+    # 下发（截断展示）
+    return f"{r['ts']} {trunc2(abs(r['usdt']))}"
+
+
+def _render(chat_id: int, title: str, limit: int | None) -> str:
+    """汇总与完整账单共用的渲染，limit 为 None 时显示全部"""
     state = load_group_state(chat_id)
     bot = state["bot_name"]
     rec_in, rec_out = state["recent"]["in"], state["recent"]["out"]
@@ -390,57 +516,36 @@ def render_full_summary(chat_id: int) -> str:
     rin, fin = state["defaults"]["in"]["rate"], state["defaults"]["in"]["fx"]
     rout, fout = state["defaults"]["out"]["rate"], state["defaults"]["out"]["fx"]
 
-    lines: list[str] = []
-    lines.append(f"【{bot} 完整账单】\n")
-
+    # 分离出金记录中的"下发"和普通出金
     normal_out = [r for r in rec_out if r.get("type") != "下发"]
     send_out = [r for r in rec_out if r.get("type") == "下发"]
 
-    # 入金记录（截断）
-    lines.append(f"已入账 ({len(rec_in)}笔)")
-    if rec_in:
-        for r in rec_in:
-            raw = r.get("raw", 0)
-            fx = r.get("fx", fin)
-            rate = r.get("rate", rin)
-            usdt = trunc2(r["usdt"])
-            rate_percent = int(rate * 100)
-            rate_sup = to_superscript(rate_percent)
-            lines.append(f"{r['ts']} {raw}  {rate_sup}/ {fx} = {usdt}")
-
-    lines.append("")
-
-    # 出金记录（四舍五入）
-    lines.append(f"已出账 ({len(normal_out)}笔)")
-    if normal_out:
-        for r in normal_out:
-            if "raw" in r:
-                raw = r.get("raw", 0)
-                fx = r.get("fx", fout)
-                rate = r.get("rate", rout)
-                usdt = round2(r["usdt"])
-                rate_percent = int(rate * 100)
-                rate_sup = to_superscript(rate_percent)
-                lines.append(f"{r['ts']} {raw}  {rate_sup}/ {fx} = {usdt}")
-
-    lines.append("")
-
-    # 下发记录（截断）
+    lines: list[str] = [
+        f"【{bot} {title}】\n",
+        f"已入账 ({len(rec_in)}笔)",
+        *[_render_in_line(r, fin, rin) for r in rec_in[:limit]],
+        "",
+        f"已出账 ({len(normal_out)}笔)",
+        *[_render_out_line(r, fout, rout) for r in normal_out[:limit] if "raw" in r],
+        "",
+    ]
     if send_out:
-        lines.append(f"已下发 ({len(send_out)}笔)")
-        for r in send_out:
-            usdt = trunc2(abs(r["usdt"]))
-            lines.append(f"{r['ts']} {usdt}")
-        lines.append("")
-
-    lines.append("━━━━━━━━━━━━━━")
-    lines.append(f"⚙️ 当前费率：入 {rin * 100:.0f}% ⇄ 出 {abs(rout) * 100:.0f}%")
-    lines.append(f"💱 固定汇率：入 {fin} ⇄ 出 {fout}")
-    lines.append(f"📊 应下发：{fmt_usdt(should)}")
-    lines.append(f"📤 已下发：{fmt_usdt(sent)}")
-    lines.append(f"{'❗' if diff != 0 else '✅'} 未下发：{fmt_usdt(diff)}")
-    lines.append("━━━━━━━━━━━━━━")
-    return "\n".join(lines)
+        lines += [
+            f"已下发 ({len(send_out)}笔)",
+            *[_render_send_line(r) for r in send_out[:limit]],
+            "",
+        ]
+
+    return "\n".join(lines) + "\n" + render_summary_footer(rin, fin, rout, fout, should, sent, diff)
+
+
+def render_group_summary(chat_id: int) -> str:
+    return _render(chat_id, "账单汇总", 5) + "\n📚 **查看更多记录**：发送「更多记录」"
+
+
+def render_full_summary(chat_id: int) -> str:
+    """显示当天所有记录"""
+    return _render(chat_id, "完整账单", None)
 
 
 # ========== Telegram ==========
@@ -452,6 +557,37 @@ from telegram.ext import (
     filters,
     ContextTypes,
 )
+from telegram.error import NetworkError, RetryAfter
+import httpx  # python-telegram-bot 的 HTTP 后端，用来判断请求是否已经发出
+
+
+# ========== 发送消息（限流 / 超时重试） ==========
+REPLY_MAX_ATTEMPTS = 3
+# handler 是串行执行的，等待期间其他消息都处理不了：Telegram 要求等待更久时直接放弃，不再重试
+REPLY_MAX_RETRY_AFTER = 5
+# 这些底层错误说明请求没有发到 Telegram（连接未建立 / 连接池没有空位），重试不会重复发消息
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+async def safe_reply_text(message, text: str, **kwargs):
+    """
+    reply_text 的重试封装：
+    - RetryAfter：按 Telegram 要求的秒数等待后重试（超过 REPLY_MAX_RETRY_AFTER 秒不重试）
+    - 请求确定没有发出的网络错误：指数退避 + 随机抖动后重试
+    读超时等错误不重试：Telegram 可能已经收到并发出消息，重试会重复发送账单
+    """
+    for attempt in range(REPLY_MAX_ATTEMPTS):
+        try:
+            return await message.reply_text(text, **kwargs)
+        except RetryAfter as e:
+            delay = float(e.retry_after)
+            if attempt == REPLY_MAX_ATTEMPTS - 1 or delay > REPLY_MAX_RETRY_AFTER:
+                raise
+            await asyncio.sleep(delay)
+        except NetworkError as e:
+            if attempt == REPLY_MAX_ATTEMPTS - 1 or not isinstance(e.__cause__, _NOT_SENT_ERRORS):
+                raise
+            await asyncio.sleep(0.2 * (2 ** attempt) + random.random() * 0.3)
 
 
 async def is_group_admin(
@@ -475,7 +611,8 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 私聊模式
     if chat.type == "private":
         if is_admin(user.id):
-            await update.message.reply_text(
+            await safe_reply_text(
+                update.message,
                 "🤖 你好，我是财务记账机器人。\n\n"
                 "📊 记账操作：\n"
                 "  入金：+10000 或 +10000 / 日本\n"
@@ -506,7 +643,8 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "  显示管理员"
             )
         else:
-            await update.message.reply_text(
+            await safe_reply_text(
+                update.message,
                 "👋 你好！欢迎使用财务记账机器人\n\n"
                 "💬 发送 /start 查看完整操作说明\n"
                 "━━━━━━━━━━━━━━━━━━━━\n\n"
@@ -517,7 +655,8 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "第4步：你就可以在群里使用 +10000 / -10000 / 下发 等功能了"
             )
     else:
-        await update.message.reply_text(
+        await safe_reply_text(
+            update.message,
             "🤖 你好，我是财务记账机器人。\n\n"
             "📊 记账操作：\n"
             "  入金：+10000 或 +10000 / 日本（支持 +1千 / +1万）\n"
@@ -543,25 +682,156 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+# 重置默认值
+async def _cmd_reset_defaults(update: Update, chat_id: int, state: dict, ts: str, dstr: str):
+    state["defaults"] = {
+        "in": {"rate": 0.10, "fx": 153},
+        "out": {"rate": 0.02, "fx": 137},  # 出金费率用正 0.02，公式里 (1 + rate)
+    }
+    await save_group_state_async(chat_id)
+
+    await safe_reply_text(
+        update.message,
+        "✅ 已重置为推荐默认值\n\n"
+        "📥 入金设置：费率 10% / 汇率 153\n"
+        "📤 出金设置：费率 2% / 汇率 137"
+    )
+
+
+# 🧹 清除 / 清空 数据（今天）—— 支持多个说法
+async def _cmd_clear_data(update: Update, chat_id: int, state: dict, ts: str, dstr: str):
+    in_count = len(state["recent"]["in"])
+    out_count = len(state["recent"]["out"])
+    should_before = trunc2(state["summary"]["should_send_usdt"])
+    sent_before = trunc2(state["summary"]["sent_usdt"])
+
+    state["recent"]["in"] = []
+    state["recent"]["out"] = []
+    state["summary"]["should_send_usdt"] = 0.0
+    state["summary"]["sent_usdt"] = 0.0
+    await save_group_state_async(chat_id)
+
+    msg = (
+        "✅ 已清除今日所有数据（00:00 至现在）\n\n"
+        f"📥 入金记录：{in_count} 笔\n"
+        f"📤 出金 + 下发记录：{out_count} 笔\n"
+        f"🧾 清除前应下发：{fmt_usdt(should_before)}\n"
+        f"📤 清除前已下发：{fmt_usdt(sent_before)}"
+    )
+    await safe_reply_text(update.message, msg)
+    await safe_reply_text(update.message, render_group_summary(chat_id))
+
+
+# 🔄 撤销入金（撤销最近一笔入金）
+async def _cmd_undo_in(update: Update, chat_id: int, state: dict, ts: str, dstr: str):
+    rec_in = state["recent"]["in"]
+    if not rec_in:
+        await safe_reply_text(update.message, "ℹ️ 今日暂无入金记录，无需撤销")
+        return
+    last = rec_in.pop(0)  # 最新一笔
+    usdt = float(last.get("usdt", 0.0))
+    state["summary"]["should_send_usdt"] = trunc2(
+        state["summary"]["should_send_usdt"] - usdt
+    )
+    await save_group_state_async(chat_id)
+    append_log(
+        log_path(chat_id, last.get("country"), dstr),
+        f"[撤销入金] 时间:{ts} 原始:{last.get('raw')} USDT:{usdt}",
+    )
+    await safe_reply_text(
+        update.message,
+        f"✅ 已撤销最近一笔入金：{last.get('raw')} → {usdt} USDT"
+    )
+    await safe_reply_text(update.message, render_group_summary(chat_id))
+
+
+# 🔄 撤销出金（撤销最近一笔普通出金）
+async def _cmd_undo_out(update: Update, chat_id: int, state: dict, ts: str, dstr: str):
+    rec_out = state["recent"]["out"]
+    # 找到最近一笔 type != '下发' 的记录
+    target_idx = None
+    for idx, r in enumerate(rec_out):
+        if r.get("type") != "下发":
+            target_idx = idx
+            break
+    if target_idx is None:
+        await safe_reply_text(update.message, "ℹ️ 今日暂无出金记录，无需撤销")
+        return
+    last = rec_out.pop(target_idx)
+    usdt = float(last.get("usdt", 0.0))
+    state["summary"]["sent_usdt"] = trunc2(
+        state["summary"]["sent_usdt"] - usdt
+    )
+    await save_group_state_async(chat_id)
+    append_log(
+        log_path(chat_id, last.get("country"), dstr),
+        f"[撤销出金] 时间:{ts} 原始:{last.get('raw')} USDT:{usdt}",
+    )
+    await safe_reply_text(
+        update.message,
+        f"✅ 已撤销最近一笔出金：{last.get('raw')} → {usdt} USDT"
+    )
+    await safe_reply_text(update.message, render_group_summary(chat_id))
+
+
+# 🔄 撤销下发（撤销最近一笔“下发 / 撤销下发”）
+async def _cmd_undo_send(update: Update, chat_id: int, state: dict, ts: str, dstr: str):
+    rec_out = state["recent"]["out"]
+    target_idx = None
+    for idx, r in enumerate(rec_out):
+        if r.get("type") == "下发":
+            target_idx = idx
+            break
+    if target_idx is None:
+        await safe_reply_text(update.message, "ℹ️ 今日暂无下发记录，无需撤销")
+        return
+    last = rec_out.pop(target_idx)
+    usdt = float(last.get("usdt", 0.0))  # 可能是正，也可能是负（下发-35.04）
+    # 撤销时反向恢复应下发
+    if usdt > 0:
+        state["summary"]["should_send_usdt"] = trunc2(
+            state["summary"]["should_send_usdt"] + usdt
+        )
+    else:
+        state["summary"]["should_send_usdt"] = trunc2(
+            state["summary"]["should_send_usdt"] - abs(usdt)
+        )
+    await save_group_state_async(chat_id)
+    append_log(
+        log_path(chat_id, None, dstr),
+        f"[撤销下发记录] 时间:{ts} USDT:{usdt}",
+    )
+    await safe_reply_text(update.message, f"✅ 已撤销最近一笔下发记录：{usdt} USDT")
+    await safe_reply_text(update.message, render_group_summary(chat_id))
+
+
+# 管理员精确匹配指令：一次 dict 查找代替逐个 if text == ...
+ADMIN_EXACT_COMMANDS = {
+    **dict.fromkeys(("重置默认值", "恢复默认值"), _cmd_reset_defaults),
+    **dict.fromkeys(("清除数据", "清空数据", "清楚数据", "清除账单", "清空账单"), _cmd_clear_data),
+    "撤销入金": _cmd_undo_in,
+    "撤销出金": _cmd_undo_out,
+    "撤销下发": _cmd_undo_send,
+}
+FULL_SUMMARY_COMMANDS = frozenset({"更多记录", "查看更多记录", "更多账单", "显示历史账单"})
+
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat = update.effective_chat
     chat_id = chat.id
     text = (update.message.text or update.message.caption or "").strip()
-    ts, dstr = now_ts(), today_str()
+    ts, dstr = now_ts_date()
 
     # ========== 私聊消息转发功能 ==========
     if chat.type == "private":
-        private_log_dir = LOG_DIR / "private_chats"
-        private_log_dir.mkdir(exist_ok=True)
-        user_log_file = private_log_dir / f"user_{user.id}.log"
+        user_log_file = PRIVATE_LOG_DIR / f"user_{user.id}.log"
 
-        log_entry = f"[{ts}] {user.full_name} (@{user.username or 'N/A'}): {text}\n"
-        with open(user_log_file, "a", encoding="utf-8") as f:
-            f.write(log_entry)
+        log_entry = f"[{ts}] {user.full_name} (@{user.username or 'N/A'}): {text}"
+        append_log(user_log_file, log_entry)
 
-        if OWNER_ID and OWNER_ID.isdigit():
-            owner_id = int(OWNER_ID)
+        if OWNER_ID_INT is not None:
+            owner_id = OWNER_ID_INT
 
             if user.id != owner_id:
                 try:
@@ -588,7 +858,8 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         context.bot_data["private_msg_map"] = {}
                     context.bot_data["private_msg_map"][sent_msg.message_id] = user.id
 
-                    await update.message.reply_text(
+                    await safe_reply_text(
+                        update.message,
                         "✅ 您的消息已发送给客服\n"
                         "⏳ 请耐心等待回复"
                     )
@@ -611,18 +882,16 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                     chat_id=target_user_id,
                                     text=f"💬 客服回复：\n\n{text}",
                                 )
-                                await update.message.reply_text("✅ 回复已发送")
+                                await safe_reply_text(update.message, "✅ 回复已发送")
 
                                 target_log_file = (
-                                    private_log_dir / f"user_{target_user_id}.log"
+                                    PRIVATE_LOG_DIR / f"user_{target_user_id}.log"
                                 )
-                                reply_log_entry = f"[{ts}] OWNER回复: {text}\n"
-                                with open(target_log_file, "a", encoding="utf-8") as f:
-                                    f.write(reply_log_entry)
+                                append_log(target_log_file, f"[{ts}] OWNER回复: {text}")
 
                                 return
                             except Exception as e:
-                                await update.message.reply_text(f"❌ 发送失败: {e}")
+                                await safe_reply_text(update.message, f"❌ 发送失败: {e}")
                                 return
 
                 if text.startswith("广播 ") or text.startswith("群发 "):
@@ -630,32 +899,35 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         text.split(" ", 1)[1] if len(text.split(" ", 1)) > 1 else ""
                     )
                     if not broadcast_text:
-                        await update.message.reply_text(
+                        await safe_reply_text(
+                            update.message,
                             "❌ 请输入广播内容，例如：广播 今天有新活动"
                         )
                         return
 
                     user_ids: list[int] = []
                     try:
-                        if private_log_dir.exists():
-                            for log_file in private_log_dir.glob("user_*.log"):
+                        if PRIVATE_LOG_DIR.exists():
+                            for log_file in PRIVATE_LOG_DIR.glob("user_*.log"):
                                 try:
                                     uid = int(log_file.stem.split("user_")[1])
-                                    if uid != int(OWNER_ID):
+                                    if uid != OWNER_ID_INT:
                                         user_ids.append(uid)
                                 except Exception:
                                     continue
                     except Exception as e:
-                        await update.message.reply_text(
+                        await safe_reply_text(
+                            update.message,
                             f"❌ 读取用户列表失败: {e}"
                         )
                         return
 
                     if not user_ids:
-                        await update.message.reply_text("❌ 暂无任何私聊用户")
+                        await safe_reply_text(update.message, "❌ 暂无任何私聊用户")
                         return
 
-                    await update.message.reply_text(
+                    await safe_reply_text(
+                        update.message,
                         f"📢 开始广播，目标用户：{len(user_ids)}"
                     )
                     success, fail = 0, 0
@@ -667,12 +939,14 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             success += 1
                         except Exception:
                             fail += 1
-                    await update.message.reply_text(
+                    await safe_reply_text(
+                        update.message,
                         f"✅ 广播完成：成功 {success}，失败 {fail}"
                     )
                     return
 
-                await update.message.reply_text(
+                await safe_reply_text(
+                    update.message,
                     "💡 使用提示：\n"
                     "• 回复转发的消息可以直接回用户\n"
                     "• 使用『广播 内容』可群发给所有私聊用户"
@@ -680,12 +954,12 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
     # ========== 群组消息处理 ==========
-    check_and_reset_daily(chat_id)
+    await check_and_reset_daily(chat_id)
     state = load_group_state(chat_id)
 
     # 查看账单
     if text == "+0":
-        await update.message.reply_text(render_group_summary(chat_id))
+        await safe_reply_text(update.message, render_group_summary(chat_id))
         return
 
     # 管理员管理命令
@@ -716,11 +990,11 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 lines.append("暂无机器人管理员")
 
-            await update.message.reply_text("\n".join(lines))
+            await safe_reply_text(update.message, "\n".join(lines))
             return
 
         if not is_admin(user.id):
-            await update.message.reply_text("🚫 你没有权限设置机器人管理员。")
+            await safe_reply_text(update.message, "🚫 你没有权限设置机器人管理员。")
             return
 
         target = None
@@ -734,7 +1008,8 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             target = update.message.reply_to_message.from_user
 
         if not target:
-            await update.message.reply_text(
+            await safe_reply_text(
+                update.message,
                 "❌ 请指定要操作的用户\n"
                 "方式1：@用户名 设置管理员\n"
                 "方式2：回复用户消息 + 设置管理员"
@@ -742,14 +1017,16 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         if text.startswith("设置"):
-            add_admin(target.id)
-            await update.message.reply_text(
+            await add_admin(target.id)
+            await safe_reply_text(
+                update.message,
                 f"✅ 已将 {target.mention_html()} 设置为机器人管理员。",
                 parse_mode="HTML",
             )
         elif text.startswith("删除"):
-            remove_admin(target.id)
-            await update.message.reply_text(
+            await remove_admin(target.id)
+            await safe_reply_text(
+                update.message,
                 f"🗑️ 已移除 {target.mention_html()} 的机器人管理员权限。",
                 parse_mode="HTML",
             )
@@ -762,7 +1039,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         country = text.replace("当前点位", "").strip()
         if not country:
-            await update.message.reply_text("❌ 请指定国家名称，例如：日本当前点位")
+            await safe_reply_text(update.message, "❌ 请指定国家名称，例如：日本当前点位")
             return
 
         countries = state["countries"]
@@ -809,64 +1086,41 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"  • 费率：{abs(out_rate) * 100:.0f}% ({out_rate_source})",
             f"  • 汇率：{out_fx} ({out_fx_source})",
         ]
-        await update.message.reply_text("\n".join(lines))
+        await safe_reply_text(update.message, "\n".join(lines))
         return
 
-    # 重置默认值
-    if text in ("重置默认值", "恢复默认值"):
-        if not is_admin(user.id):
-            return
-
-        state["defaults"] = {
-            "in": {"rate": 0.10, "fx": 153},
-            "out": {"rate": 0.02, "fx": 137},  # 出金费率用正 0.02，公式里 (1 + rate)
-        }
-        save_group_state(chat_id)
-
-        await update.message.reply_text(
-            "✅ 已重置为推荐默认值\n\n"
-            "📥 入金设置：费率 10% / 汇率 153\n"
-            "📤 出金设置：费率 2% / 汇率 137"
-        )
+    # 精确匹配指令（重置 / 清除 / 撤销）
+    handler = ADMIN_EXACT_COMMANDS.get(text)
+    if handler is not None:
+        if is_admin(user.id):
+            await handler(update, chat_id, state, ts, dstr)
         return
 
     # 简单设置入金/出金默认费率/汇率
-    if text.startswith(("设置入金费率", "设置入金汇率", "设置出金费率", "设置出金汇率")):
+    simple_setting = SIMPLE_SETTING_COMMANDS.get(text[:6])
+    if simple_setting:
         if not is_admin(user.id):
             return
         try:
-            direction = ""
-            key = ""
-            val = 0.0
-            display_val = ""
-
-            if "入金费率" in text:
-                direction, key = "in", "rate"
-                val = float(text.replace("设置入金费率", "").strip()) / 100.0
+            direction, key = simple_setting
+            val = float(text[6:].strip())
+            if key == "rate":
+                val /= 100.0
                 display_val = f"{val * 100:.0f}%"
-            elif "入金汇率" in text:
-                direction, key = "in", "fx"
-                val = float(text.replace("设置入金汇率", "").strip())
-                display_val = str(val)
-            elif "出金费率" in text:
-                direction, key = "out", "rate"
-                val = float(text.replace("设置出金费率", "").strip()) / 100.0
-                display_val = f"{val * 100:.0f}%"
-            elif "出金汇率" in text:
-                direction, key = "out", "fx"
-                val = float(text.replace("设置出金汇率", "").strip())
+            else:
                 display_val = str(val)
 
             state["defaults"][direction][key] = val
-            save_group_state(chat_id)
+            await save_group_state_async(chat_id)
 
             type_name = "费率" if key == "rate" else "汇率"
             dir_name = "入金" if direction == "in" else "出金"
-            await update.message.reply_text(
+            await safe_reply_text(
+                update.message,
                 f"✅ 已设置默认{dir_name}{type_name}\n📊 新值：{display_val}"
             )
         except ValueError:
-            await update.message.reply_text("❌ 格式错误，请输入有效的数字\n例如：设置入金费率 10")
+            await safe_reply_text(update.message, "❌ 格式错误，请输入有效的数字\n例如：设置入金费率 10")
         return
 
     # 高级设置命令（指定国家）
@@ -874,8 +1128,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not is_admin(user.id):
             return
 
-        pattern = r"^设置\s*(.+?)(入|出)(费率|汇率)\s*(\d+(?:\.\d+)?)\s*$"
-        match = re.match(pattern, text)
+        match = _SCOPE_SETTING_RE.match(text)
 
         if match:
             scope = match.group(1).strip()
@@ -891,130 +1144,18 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     state["countries"].setdefault(scope, {}).setdefault(
                         direction, {}
                     )[key] = val
-                save_group_state(chat_id)
+                await save_group_state_async(chat_id)
 
                 type_name = "费率" if key == "rate" else "汇率"
                 dir_name = "入金" if direction == "in" else "出金"
                 display_val = f"{val * 100:.0f}%" if key == "rate" else str(val)
-                await update.message.reply_text(
+                await safe_reply_text(
+                    update.message,
                     f"✅ 已设置 {scope} {dir_name}{type_name}\n📊 新值：{display_val}"
                 )
             except ValueError:
-                await update.message.reply_text("❌ 数值格式错误")
-            return
-
-    # 🧹 清除 / 清空 数据（今天）—— 支持多个说法
-    if text in ("清除数据", "清空数据", "清楚数据", "清除账单", "清空账单"):
-        if not is_admin(user.id):
+                await safe_reply_text(update.message, "❌ 数值格式错误")
             return
-        in_count = len(state["recent"]["in"])
-        out_count = len(state["recent"]["out"])
-        should_before = trunc2(state["summary"]["should_send_usdt"])
-        sent_before = trunc2(state["summary"]["sent_usdt"])
-
-        state["recent"]["in"] = []
-        state["recent"]["out"] = []
-        state["summary"]["should_send_usdt"] = 0.0
-        state["summary"]["sent_usdt"] = 0.0
-        save_group_state(chat_id)
-
-        msg = (
-            "✅ 已清除今日所有数据（00:00 至现在）\n\n"
-            f"📥 入金记录：{in_count} 笔\n"
-            f"📤 出金 + 下发记录：{out_count} 笔\n"
-            f"🧾 清除前应下发：{fmt_usdt(should_before)}\n"
-            f"📤 清除前已下发：{fmt_usdt(sent_before)}"
-        )
-        await update.message.reply_text(msg)
-        await update.message.reply_text(render_group_summary(chat_id))
-        return
-
-    # 🔄 撤销入金（撤销最近一笔入金）
-    if text == "撤销入金":
-        if not is_admin(user.id):
-            return
-        rec_in = state["recent"]["in"]
-        if not rec_in:
-            await update.message.reply_text("ℹ️ 今日暂无入金记录，无需撤销")
-            return
-        last = rec_in.pop(0)  # 最新一笔
-        usdt = float(last.get("usdt", 0.0))
-        state["summary"]["should_send_usdt"] = trunc2(
-            state["summary"]["should_send_usdt"] - usdt
-        )
-        save_group_state(chat_id)
-        append_log(
-            log_path(chat_id, last.get("country"), dstr),
-            f"[撤销入金] 时间:{ts} 原始:{last.get('raw')} USDT:{usdt}",
-        )
-        await update.message.reply_text(
-            f"✅ 已撤销最近一笔入金：{last.get('raw')} → {usdt} USDT"
-        )
-        await update.message.reply_text(render_group_summary(chat_id))
-        return
-
-    # 🔄 撤销出金（撤销最近一笔普通出金）
-    if text == "撤销出金":
-        if not is_admin(user.id):
-            return
-        rec_out = state["recent"]["out"]
-        # 找到最近一笔 type != '下发' 的记录
-        target_idx = None
-        for idx, r in enumerate(rec_out):
-            if r.get("type") != "下发":
-                target_idx = idx
-                break
-        if target_idx is None:
-            await update.message.reply_text("ℹ️ 今日暂无出金记录，无需撤销")
-            return
-        last = rec_out.pop(target_idx)
-        usdt = float(last.get("usdt", 0.0))
-        state["summary"]["sent_usdt"] = trunc2(
-            state["summary"]["sent_usdt"] - usdt
-        )
-        save_group_state(chat_id)
-        append_log(
-            log_path(chat_id, last.get("country"), dstr),
-            f"[撤销出金] 时间:{ts} 原始:{last.get('raw')} USDT:{usdt}",
-        )
-        await update.message.reply_text(
-            f"✅ 已撤销最近一笔出金：{last.get('raw')} → {usdt} USDT"
-        )
-        await update.message.reply_text(render_group_summary(chat_id))
-        return
-
-    # 🔄 撤销下发（撤销最近一笔“下发 / 撤销下发”）
-    if text == "撤销下发":
-        if not is_admin(user.id):
-            return
-        rec_out = state["recent"]["out"]
-        target_idx = None
-        for idx, r in enumerate(rec_out):
-            if r.get("type") == "下发":
-                target_idx = idx
-                break
-        if target_idx is None:
-            await update.message.reply_text("ℹ️ 今日暂无下发记录，无需撤销")
-            return
-        last = rec_out.pop(target_idx)
-        usdt = float(last.get("usdt", 0.0))  # 可能是正，也可能是负（下发-35.04）
-        # 撤销时反向恢复应下发
-        if usdt > 0:
-            state["summary"]["should_send_usdt"] = trunc2(
-                state["summary"]["should_send_usdt"] + usdt
-            )
-        else:
-            state["summary"]["should_send_usdt"] = trunc2(
-                state["summary"]["should_send_usdt"] - abs(usdt)
-            )
-        save_group_state(chat_id)
-        append_log(
-            log_path(chat_id, None, dstr),
-            f"[撤销下发记录] 时间:{ts} USDT:{usdt}",
-        )
-        await update.message.reply_text(f"✅ 已撤销最近一笔下发记录：{usdt} USDT")
-        await update.message.reply_text(render_group_summary(chat_id))
-        return
 
     # 入金（截断）
     if text.startswith("+"):
@@ -1025,7 +1166,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         p = resolve_params(chat_id, "in", country)
         if p["fx"] == 0:
-            await update.message.reply_text("⚠️ 请先设置费率和汇率")
+            await safe_reply_text(update.message, "⚠️ 请先设置费率和汇率")
             return
 
         usdt = trunc2(amt * (1 - p["rate"]) / p["fx"])
@@ -1044,12 +1185,12 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         state["summary"]["should_send_usdt"] = trunc2(
             state["summary"]["should_send_usdt"] + usdt
         )
-        save_group_state(chat_id)
+        await save_group_state_async(chat_id)
         append_log(
             log_path(chat_id, country, dstr),
             f"[入金] 时间:{ts} 国家:{country or '通用'} 原始:{amt} 汇率:{p['fx']} 费率:{p['rate']*100:.2f}% 结果:{usdt}",
         )
-        await update.message.reply_text(render_group_summary(chat_id))
+        await safe_reply_text(update.message, render_group_summary(chat_id))
         return
 
     # 出金（四舍五入）
@@ -1061,7 +1202,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         p = resolve_params(chat_id, "out", country)
         if p["fx"] == 0:
-            await update.message.reply_text("⚠️ 请先设置费率和汇率")
+            await safe_reply_text(update.message, "⚠️ 请先设置费率和汇率")
             return
 
         usdt = round2(amt * (1 + p["rate"]) / p["fx"])
@@ -1080,12 +1221,12 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         state["summary"]["sent_usdt"] = trunc2(
             state["summary"]["sent_usdt"] + usdt
         )
-        save_group_state(chat_id)
+        await save_group_state_async(chat_id)
         append_log(
             log_path(chat_id, country, dstr),
             f"[出金] 时间:{ts} 国家:{country or '通用'} 原始:{amt} 汇率:{p['fx']} 费率:{p['rate']*100:.2f}% 下发:{usdt}",
         )
-        await update.message.reply_text(render_group_summary(chat_id))
+        await safe_reply_text(update.message, render_group_summary(chat_id))
         return
 
     # 下发USDT（截断）
@@ -1118,17 +1259,18 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     f"[撤销下发] 时间:{ts} 金额:{usdt_abs} USDT",
                 )
 
-            save_group_state(chat_id)
-            await update.message.reply_text(render_group_summary(chat_id))
+            await save_group_state_async(chat_id)
+            await safe_reply_text(update.message, render_group_summary(chat_id))
         except ValueError:
-            await update.message.reply_text(
+            await safe_reply_text(
+                update.message,
                 "❌ 格式错误，请输入有效的数字\n例如：下发35.04 或 下发-35.04"
             )
         return
 
     # 查看更多记录
-    if text in ["更多记录", "查看更多记录", "更多账单", "显示历史账单"]:
-        await update.message.reply_text(render_full_summary(chat_id))
+    if text in FULL_SUMMARY_COMMANDS:
+        await safe_reply_text(update.message, render_full_summary(chat_id))
         return
 
     # 其他无回复，忽略
@@ -1136,49 +1278,115 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ========== HTTP健康检查服务器 ==========
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path in ["/", "/health"]:
-            self.send_response(200)
-            self.send_header("Content-type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"OK")
-        else:
-            self.send_response(404)
-            self.end_headers()
+# 直接跑在 Bot 的事件循环上（asyncio.start_server），不再单独开线程
+HEALTH_PATHS = ("/", "/health")
+_health_server: asyncio.AbstractServer | None = None
+
 
-    def log_message(self, format, *args):
-        # 不在日志里输出 HTTP 访问记录，保持控制台干净
+async def handle_health_check(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # 读掉请求头
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if line in (b"\r\n", b"\n", b""):
+                break
+        parts = request_line.split()
+        path = parts[1].decode("latin-1") if len(parts) > 1 else ""
+        if path in HEALTH_PATHS:
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-type: text/plain\r\n"
+                b"Content-Length: 2\r\nConnection: close\r\n\r\nOK"
+            )
+        else:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+    except (asyncio.TimeoutError, ValueError, ConnectionError, asyncio.IncompleteReadError):
+        # 超时、请求行/请求头超长（ValueError）、连接中断：直接断开，不产生未处理异常
         pass
+    finally:
+        writer.close()
+
+
+async def start_health_server() -> None:
+    global _health_server
+    port = int(os.getenv("PORT", "10000"))
+    try:
+        _health_server = await asyncio.start_server(handle_health_check, "0.0.0.0", port)
+    except OSError as e:
+        # 端口被占用等：只影响健康检查，机器人照常运行
+        print(f"⚠️ HTTP 健康检查服务器启动失败（端口 {port}）: {e}")
+        return
+    print(f"✅ HTTP服务器已启动: http://0.0.0.0:{port}")
+
+
+async def stop_health_server(application) -> None:
+    if _health_server is not None:
+        _health_server.close()
+        await _health_server.wait_closed()
+
+
+async def on_startup(application) -> None:
+    await start_flusher()
+
+
+async def on_shutdown(application) -> None:
+    await stop_flusher()
+    await stop_health_server(application)
+
+
+# ========== 单实例锁 ==========
+# 同一数据目录只允许一个轮询进程，避免多个实例重复拉取更新、重复写账
+_instance_lock_fd: int | None = None
+
+
+def acquire_instance_lock() -> bool:
+    global _instance_lock_fd
+    if fcntl is None:
+        return True
+    fd = os.open(DATA_DIR / ".bot.lock", os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    _instance_lock_fd = fd
+    return True
 
 
 # ========== 初始化函数 ==========
+_BANNER = "=" * 50
+
+
 def init_bot():
-    print("=" * 50)
+    print(_BANNER)
     print("🚀 正在启动财务记账机器人...")
-    print("=" * 50)
+    print(_BANNER)
 
     if not BOT_TOKEN:
         print("❌ 错误：未找到 TELEGRAM_BOT_TOKEN 环境变量")
         exit(1)
 
+    if not acquire_instance_lock():
+        print("❌ 错误：已有机器人实例在运行（同一数据目录），本进程退出")
+        exit(1)
+
     print("✅ Bot Token 已加载")
     print(f"📊 数据目录: {DATA_DIR}")
     print(f"👑 超级管理员: {OWNER_ID or '未设置'}")
 
-    port = int(os.getenv("PORT", "10000"))
-    print(f"\n🌐 启动HTTP健康检查服务器（端口 {port}）...")
-
-    def run_http_server():
-        server = HTTPServer(("0.0.0.0", port), HealthCheckHandler)
-        print(f"✅ HTTP服务器已启动: http://0.0.0.0:{port}")
-        server.serve_forever()
-
-    http_thread = threading.Thread(target=run_http_server, daemon=True)
-    http_thread.start()
-
     print("\n🤖 配置 Telegram Bot (Polling模式)...")
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    # 出站请求连接池：默认只有 1 个连接，多条 reply_text 会互相排队
+    application = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .connection_pool_size(32)
+        .connect_timeout(5)
+        .read_timeout(20)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     application.add_handler(CommandHandler("start", cmd_start))
     application.add_handler(
         MessageHandler(
@@ -1189,7 +1397,15 @@ def init_bot():
     print("✅ Bot 处理器已注册")
 
     print("\n🎉 机器人正在运行，等待消息...")
-    print("=" * 50)
+    print(_BANNER)
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        print("⚡ 已启用 uvloop 事件循环")
+    # 健康检查端口在连接 Telegram（initialize / getMe）之前绑定：API 响应慢时平台的端口检测也能通过。
+    # run_polling 沿用这里设置的事件循环，健康检查服务器和 Bot 跑在同一个循环上
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(start_health_server())
     application.run_polling()
 
 
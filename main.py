@@ -14,28 +14,31 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Webhook 已成功运行在 ClawCloud ✅")
 
 
-async def main():
-    app = Application.builder().token(TOKEN).build()
+def main():
+    app = (
+        Application.builder()
+        .token(TOKEN)
+        .connection_pool_size(32)
+        .connect_timeout(5)
+        .read_timeout(20)
+        .build()
+    )
 
     # Commands
     app.add_handler(CommandHandler("start", start))
 
-    # --- Setup webhook on Telegram ---
-    await app.bot.set_webhook(
-        url=WEBHOOK_URL,
-        drop_pending_updates=True
-    )
-
-    print("Webhook 设置成功：", WEBHOOK_URL)
+    print("Webhook 地址：", WEBHOOK_URL)
 
     # --- Start webhook server (inside container) ---
-    await app.run_webhook(
+    # webhook 由 run_webhook 启动时统一设置（只设置一次，且用公网地址而不是 0.0.0.0）
+    app.run_webhook(
         listen="0.0.0.0",
         port=PORT,
         url_path=TOKEN,
+        webhook_url=WEBHOOK_URL,
+        drop_pending_updates=True,
     )
 
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
+    main()
@@ -0,0 +1,134 @@
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SESSION_SECRET", "test-secret")
+
+import web_app  # noqa: E402
+
+
+class TokenTest(unittest.TestCase):
+    def test_round_trip(self):
+        token = web_app.generate_token(-100123, 42)
+        self.assertEqual(web_app.verify_token(token), {"chat_id": -100123, "user_id": 42})
+
+    def test_matches_documented_format(self):
+        # WEB_DASHBOARD_GUIDE.md: token = chat_id:user_id:expires_at:HMAC-SHA256 十六进制
+        data = f"-5:7:{int(time.time()) + 3600}"
+        signature = hmac.new(web_app.TOKEN_SECRET.encode(), data.encode(), hashlib.sha256).hexdigest()
+        self.assertEqual(web_app.verify_token(f"{data}:{signature}"), {"chat_id": -5, "user_id": 7})
+
+        chat_id, user_id, expires_at, signature = web_app.generate_token(-5, 7).split(":")
+        expected = hmac.new(
+            web_app.TOKEN_SECRET.encode(), f"{chat_id}:{user_id}:{expires_at}".encode(), hashlib.sha256
+        ).hexdigest()
+        self.assertEqual(signature, expected)
+
+    def test_tampered_mac(self):
+        token = web_app.generate_token(-1, 42)
+        flipped = "0" if token[-1] != "0" else "1"
+        self.assertIsNone(web_app.verify_token(token[:-1] + flipped))
+
+    def test_tampered_payload(self):
+        chat_id, user_id, expires_at, signature = web_app.generate_token(-1, 42).split(":")
+        self.assertIsNone(web_app.verify_token(f"{chat_id}:{web_app.OWNER_ID}:{expires_at}:{signature}"))
+
+    def test_wrong_length(self):
+        token = web_app.generate_token(-1, 42)
+        self.assertIsNone(web_app.verify_token(token[:-2]))
+        self.assertIsNone(web_app.verify_token(token + "00"))
+        self.assertIsNone(web_app.verify_token(token.rsplit(":", 1)[0]))
+        self.assertIsNone(web_app.verify_token(token + ":extra"))
+        self.assertIsNone(web_app.verify_token(""))
+        self.assertIsNone(web_app.verify_token("a:b:c:d"))
+        self.assertIsNone(web_app.verify_token(token[:-1] + "é"))
+
+    def test_expired(self):
+        token = web_app.generate_token(-1, 42, expires_hours=-1)
+        self.assertIsNone(web_app.verify_token(token))
+
+
+class ApiTransactionsTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        groups_dir = web_app.Path(self._tmp.name)
+        patcher = mock.patch.object(web_app, "GROUPS_DIR", groups_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self._tmp.cleanup)
+
+        records = [
+            {"time": "2025-01-01 10:00:00", "amount": 10, "usdt": 1, "operator": operator}
+            for operator in (123, None, "alice")
+        ]
+        data = {"deposit_records": records, "withdrawal_records": [], "disbursement_records": []}
+        with open(groups_dir / "group_-1.json", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+        self.client = web_app.app.test_client()
+        self.token = web_app.generate_token(-1, web_app.OWNER_ID)
+
+    def test_non_string_operator_keys(self):
+        resp = self.client.get(f"/api/transactions?token={self.token}")
+        self.assertEqual(resp.status_code, 200)
+        body = json.loads(resp.get_data())
+        self.assertEqual(len(body["records"]), 3)
+        self.assertEqual(set(body["statistics"]["by_operator"]), {"123", "null", "alice"})
+
+    def test_stats_serialization_error_is_500(self):
+        with mock.patch.object(web_app, "_dumps", side_effect=TypeError("boom")):
+            resp = self.client.get(f"/api/transactions?token={self.token}")
+        self.assertEqual(resp.status_code, 500)
+
+
+class SaveGroupDataTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.groups_dir = web_app.Path(self._tmp.name)
+        patcher = mock.patch.object(web_app, "GROUPS_DIR", self.groups_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self._tmp.cleanup)
+
+    def test_writes_without_leftover_temp_files(self):
+        web_app.save_group_data(-1, {"a": 1})
+        web_app.save_group_data(-1, {"a": 2})
+        self.assertEqual(os.listdir(self.groups_dir), ["group_-1.json"])
+        self.assertEqual(web_app.load_group_data(-1), {"a": 2})
+
+    def test_serialization_error_leaves_no_temp_file(self):
+        with self.assertRaises(TypeError):
+            web_app.save_group_data(-1, {"a": object()})
+        self.assertEqual(os.listdir(self.groups_dir), [])
+
+    def test_replace_error_removes_temp_file(self):
+        web_app.save_group_data(-1, {"a": 1})
+        with mock.patch.object(web_app.os, "replace", side_effect=OSError("boom")):
+            with self.assertRaises(OSError):
+                web_app.save_group_data(-1, {"a": 2})
+        self.assertEqual(os.listdir(self.groups_dir), ["group_-1.json"])
+        self.assertEqual(web_app.load_group_data(-1), {"a": 1})
+
+
+class ApiRollbackTest(unittest.TestCase):
+    def setUp(self):
+        self.client = web_app.app.test_client()
+        self.token = web_app.generate_token(-1, web_app.OWNER_ID)
+
+    def test_non_object_json_body_is_400(self):
+        for body in ("[1, 2]", "42", '"deposit"', "null", "not json"):
+            resp = self.client.post(
+                f"/api/rollback?token={self.token}", data=body, content_type="application/json"
+            )
+            self.assertEqual(resp.status_code, 400, body)
+
+
+if __name__ == "__main__":
+    unittest.main()
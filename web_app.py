@@ -8,12 +8,18 @@ Web查账系统 - Flask应用
 import os
 import json
 import hmac
+import tempfile
 import hashlib
 from datetime import datetime, timedelta
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session
 from functools import wraps
 
+try:
+    import orjson  # 可选：C 实现的 JSON 库，群组文件读写和流式输出时优先使用
+except ImportError:
+    orjson = None
+
 app = Flask(__name__)
 
 # 配置 - 强制要求SESSION_SECRET
@@ -33,47 +39,44 @@ GROUPS_DIR = DATA_DIR / "groups"
 
 # ========== Token认证系统 ==========
 
+# token = chat_id:user_id:expires_at:signature
+# signature = HMAC-SHA256(chat_id:user_id:expires_at, TOKEN_SECRET) 的十六进制
+# 格式与 WEB_DASHBOARD_GUIDE.md 一致，外部签发方按此格式生成 token，不能改动
+# 密钥只处理一次：预先建好 HMAC 对象，每次签名/验证时 copy()，省去重新计算密钥填充
+_TOKEN_HMAC = hmac.new(TOKEN_SECRET.encode(), digestmod=hashlib.sha256)
+
+def _token_signature(data: str) -> str:
+    h = _TOKEN_HMAC.copy()
+    h.update(data.encode())
+    return h.hexdigest()
+
 def generate_token(chat_id: int, user_id: int, expires_hours: int = 24):
     """生成临时访问token"""
     expires_at = int((datetime.now() + timedelta(hours=expires_hours)).timestamp())
     data = f"{chat_id}:{user_id}:{expires_at}"
-    signature = hmac.new(
-        TOKEN_SECRET.encode(),
-        data.encode(),
-        hashlib.sha256
-    ).hexdigest()
-    return f"{data}:{signature}"
+    return f"{data}:{_token_signature(data)}"
 
 def verify_token(token: str):
     """验证token有效性"""
+    parts = token.split(":")
+    if len(parts) != 4:
+        return None
+    
     try:
-        parts = token.split(":")
-        if len(parts) != 4:
-            return None
-        
-        chat_id, user_id, expires_at, signature = parts
-        chat_id = int(chat_id)
-        user_id = int(user_id)
-        expires_at = int(expires_at)
-        
-        # 验证签名
-        data = f"{chat_id}:{user_id}:{expires_at}"
-        expected_signature = hmac.new(
-            TOKEN_SECRET.encode(),
-            data.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        
-        if signature != expected_signature:
-            return None
-        
-        # 验证过期时间
-        if datetime.now().timestamp() > expires_at:
-            return None
-        
-        return {"chat_id": chat_id, "user_id": user_id}
-    except:
+        chat_id, user_id, expires_at = int(parts[0]), int(parts[1]), int(parts[2])
+    except ValueError:
+        return None
+    
+    # 验证签名（常量时间比较；签名按规范化后的数字计算，与签发方一致）
+    expected_signature = _token_signature(f"{chat_id}:{user_id}:{expires_at}")
+    if not hmac.compare_digest(parts[3].encode(), expected_signature.encode()):
+        return None
+    
+    # 验证过期时间
+    if datetime.now().timestamp() > expires_at:
         return None
+    
+    return {"chat_id": chat_id, "user_id": user_id}
 
 def login_required(f):
     """登录验证装饰器"""
@@ -96,6 +99,16 @@ def login_required(f):
 
 # ========== 数据读取函数 ==========
 
+# 群组文件格式与 json.dump(ensure_ascii=False, indent=2) 一致，与 Bot 端写出的文件相同
+if orjson is not None:
+    def _dump_group(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    _load_json = orjson.loads
+else:
+    def _dump_group(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    _load_json = json.loads
+
 def load_group_data(chat_id: int):
     """加载群组数据"""
     file_path = GROUPS_DIR / f"group_{chat_id}.json"
@@ -103,136 +116,186 @@ def load_group_data(chat_id: int):
         return None
     
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return _load_json(file_path.read_bytes())
     except:
         return None
 
 def save_group_data(chat_id: int, data: dict):
-    """保存群组数据"""
+    """保存群组数据（临时文件 + 原子替换，Bot 同时读取时不会读到半截文件）"""
     GROUPS_DIR.mkdir(parents=True, exist_ok=True)
     file_path = GROUPS_DIR / f"group_{chat_id}.json"
-    
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    payload = _dump_group(data)
+    # mkstemp 保证临时文件唯一：Bot 和多个 gunicorn worker 同时写同一群组时不会共用临时文件
+    fd, tmp_name = tempfile.mkstemp(dir=GROUPS_DIR, prefix=f"{file_path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, file_path)
+    except Exception:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
 
-def get_all_transactions(chat_id: int, start_date=None, end_date=None):
-    """获取所有交易记录（支持日期筛选）"""
-    data = load_group_data(chat_id)
-    if not data:
-        return []
-    
+# 操作员统计在遍历时用定长列表累加（按下标更新），最后一次性转换成响应里的字典
+_OPERATOR_BUCKET_KEYS = (
+    "deposit_count",
+    "deposit_usdt",
+    "withdrawal_count",
+    "withdrawal_usdt",
+    "disbursement_count",
+    "disbursement_usdt"
+)
+
+def get_transactions_with_statistics(chat_id: int, start_date=None, end_date=None, with_records=True):
+    """
+    获取所有交易记录（支持日期筛选），并在读取数据的同一次遍历中完成统计
+    返回 (records, statistics)；with_records=False 时只统计，records 为空列表
+    """
+    total_deposit = 0
+    total_deposit_usdt = 0
+    total_withdrawal = 0
+    total_withdrawal_usdt = 0
+    total_disbursement = 0
+    by_operator = {}
     all_records = []
     
+    data = load_group_data(chat_id) or {}
+    # 记录时间格式固定为 "%Y-%m-%d %H:%M:%S"，fromisoformat 是 C 实现，比 strptime 快一个数量级
+    parse_time = datetime.fromisoformat
+    
     # 处理入金记录
     for record in data.get("deposit_records", []):
-        record_date = datetime.strptime(record["time"], "%Y-%m-%d %H:%M:%S")
+        record_date = parse_time(record["time"])
         if start_date and record_date < start_date:
             continue
         if end_date and record_date > end_date:
             continue
         
-        all_records.append({
-            "type": "deposit",
-            "time": record["time"],
-            "amount": record["amount"],
-            "fee_rate": record.get("fee_rate", data.get("deposit_fee_rate", 0)),
-            "exchange_rate": record.get("fx", data.get("deposit_fx", 0)),
-            "usdt": record["usdt"],
-            "operator": record.get("operator", "未知"),
-            "message_id": record.get("message_id"),
-            "timestamp": record_date.timestamp()
-        })
+        operator = record.get("operator", "未知")
+        usdt = record["usdt"]
+        if with_records:
+            all_records.append({
+                "type": "deposit",
+                "time": record["time"],
+                "amount": record["amount"],
+                "fee_rate": record.get("fee_rate", data.get("deposit_fee_rate", 0)),
+                "exchange_rate": record.get("fx", data.get("deposit_fx", 0)),
+                "usdt": usdt,
+                "operator": operator,
+                "message_id": record.get("message_id"),
+                "timestamp": record_date.timestamp()
+            })
+        
+        total_deposit += record["amount"]
+        total_deposit_usdt += usdt
+        bucket = by_operator.get(operator)
+        if bucket is None:
+            bucket = by_operator[operator] = [0, 0, 0, 0, 0, 0]
+        bucket[0] += 1
+        bucket[1] += usdt
     
     # 处理出金记录
     for record in data.get("withdrawal_records", []):
-        record_date = datetime.strptime(record["time"], "%Y-%m-%d %H:%M:%S")
+        record_date = parse_time(record["time"])
         if start_date and record_date < start_date:
             continue
         if end_date and record_date > end_date:
             continue
         
-        all_records.append({
-            "type": "withdrawal",
-            "time": record["time"],
-            "amount": record["amount"],
-            "fee_rate": record.get("fee_rate", data.get("withdrawal_fee_rate", 0)),
-            "exchange_rate": record.get("fx", data.get("withdrawal_fx", 0)),
-            "usdt": record["usdt"],
-            "operator": record.get("operator", "未知"),
-            "message_id": record.get("message_id"),
-            "timestamp": record_date.timestamp()
-        })
+        operator = record.get("operator", "未知")
+        usdt = record["usdt"]
+        if with_records:
+            all_records.append({
+                "type": "withdrawal",
+                "time": record["time"],
+                "amount": record["amount"],
+                "fee_rate": record.get("fee_rate", data.get("withdrawal_fee_rate", 0)),
+                "exchange_rate": record.get("fx", data.get("withdrawal_fx", 0)),
+                "usdt": usdt,
+                "operator": operator,
+                "message_id": record.get("message_id"),
+                "timestamp": record_date.timestamp()
+            })
+        
+        total_withdrawal += record["amount"]
+        total_withdrawal_usdt += usdt
+        bucket = by_operator.get(operator)
+        if bucket is None:
+            bucket = by_operator[operator] = [0, 0, 0, 0, 0, 0]
+        bucket[2] += 1
+        bucket[3] += usdt
     
     # 处理下发记录
     for record in data.get("disbursement_records", []):
-        record_date = datetime.strptime(record["time"], "%Y-%m-%d %H:%M:%S")
+        record_date = parse_time(record["time"])
         if start_date and record_date < start_date:
             continue
         if end_date and record_date > end_date:
             continue
         
-        all_records.append({
-            "type": "disbursement",
-            "time": record["time"],
-            "amount": record["usdt"],
-            "fee_rate": 0,
-            "exchange_rate": 0,
-            "usdt": record["usdt"],
-            "operator": record.get("operator", "未知"),
-            "message_id": record.get("message_id"),
-            "timestamp": record_date.timestamp()
-        })
+        operator = record.get("operator", "未知")
+        usdt = record["usdt"]
+        if with_records:
+            all_records.append({
+                "type": "disbursement",
+                "time": record["time"],
+                "amount": usdt,
+                "fee_rate": 0,
+                "exchange_rate": 0,
+                "usdt": usdt,
+                "operator": operator,
+                "message_id": record.get("message_id"),
+                "timestamp": record_date.timestamp()
+            })
+        
+        total_disbursement += usdt
+        bucket = by_operator.get(operator)
+        if bucket is None:
+            bucket = by_operator[operator] = [0, 0, 0, 0, 0, 0]
+        bucket[4] += 1
+        bucket[5] += usdt
     
     # 按时间倒序排序
     all_records.sort(key=lambda x: x["timestamp"], reverse=True)
     
-    return all_records
-
-def calculate_statistics(records):
-    """计算统计数据"""
     stats = {
-        "total_deposit": 0,
-        "total_deposit_usdt": 0,
-        "total_withdrawal": 0,
-        "total_withdrawal_usdt": 0,
-        "total_disbursement": 0,
-        "pending_disbursement": 0,
-        "by_operator": {}
+        "total_deposit": total_deposit,
+        "total_deposit_usdt": total_deposit_usdt,
+        "total_withdrawal": total_withdrawal,
+        "total_withdrawal_usdt": total_withdrawal_usdt,
+        "total_disbursement": total_disbursement,
+        "pending_disbursement": total_deposit_usdt - total_withdrawal_usdt - total_disbursement,
+        "by_operator": {
+            operator: dict(zip(_OPERATOR_BUCKET_KEYS, bucket))
+            for operator, bucket in by_operator.items()
+        }
     }
-    
-    for record in records:
-        operator = record["operator"]
-        if operator not in stats["by_operator"]:
-            stats["by_operator"][operator] = {
-                "deposit_count": 0,
-                "deposit_usdt": 0,
-                "withdrawal_count": 0,
-                "withdrawal_usdt": 0,
-                "disbursement_count": 0,
-                "disbursement_usdt": 0
-            }
-        
-        if record["type"] == "deposit":
-            stats["total_deposit"] += record["amount"]
-            stats["total_deposit_usdt"] += record["usdt"]
-            stats["by_operator"][operator]["deposit_count"] += 1
-            stats["by_operator"][operator]["deposit_usdt"] += record["usdt"]
-        
-        elif record["type"] == "withdrawal":
-            stats["total_withdrawal"] += record["amount"]
-            stats["total_withdrawal_usdt"] += record["usdt"]
-            stats["by_operator"][operator]["withdrawal_count"] += 1
-            stats["by_operator"][operator]["withdrawal_usdt"] += record["usdt"]
-        
-        elif record["type"] == "disbursement":
-            stats["total_disbursement"] += record["usdt"]
-            stats["by_operator"][operator]["disbursement_count"] += 1
-            stats["by_operator"][operator]["disbursement_usdt"] += record["usdt"]
-    
-    stats["pending_disbursement"] = stats["total_deposit_usdt"] - stats["total_withdrawal_usdt"] - stats["total_disbursement"]
-    
-    return stats
+    return all_records, stats
+
+# 每批序列化的记录条数（流式输出，避免一次性生成整个 JSON 字符串）
+STREAM_BATCH_SIZE = 500
+
+# by_operator 的 key 来自记录里的 operator，可能是整数 ID 或 null，需要转成字符串 key
+if orjson is not None:
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def iter_transactions_json(records, stats):
+    """分批生成 {"success": true, "records": [...], "statistics": {...}}"""
+    # 统计部分在开始输出前序列化：出错时在返回响应之前抛出（500），不会输出半截 JSON
+    stats_json = _dumps(stats)
+
+    def generate():
+        yield b'{"success": true, "records": ['
+        for i in range(0, len(records), STREAM_BATCH_SIZE):
+            chunk = b",".join([_dumps(r) for r in records[i:i + STREAM_BATCH_SIZE]])
+            yield chunk if i == 0 else b"," + chunk
+        yield b'], "statistics": ' + stats_json + b"}"
+
+    return generate()
 
 # ========== 路由 ==========
 
@@ -292,15 +355,13 @@ def api_transactions():
     if end_date_str:
         end_date = datetime.strptime(end_date_str, "%Y-%m-%d") + timedelta(days=1)
     
+    # stats_only=1：轮询统计的客户端不需要明细，跳过记录构建和排序
+    stats_only = request.args.get('stats_only') == '1'
+    
     # 获取交易记录
-    records = get_all_transactions(chat_id, start_date, end_date)
-    stats = calculate_statistics(records)
+    records, stats = get_transactions_with_statistics(chat_id, start_date, end_date, with_records=not stats_only)
     
-    return jsonify({
-        "success": True,
-        "records": records,
-        "statistics": stats
-    })
+    return Response(iter_transactions_json(records, stats), mimetype="application/json")
 
 @app.route("/api/rollback", methods=["POST"])
 @login_required
@@ -314,8 +375,10 @@ def api_rollback():
     if user_id != OWNER_ID:
         return jsonify({"success": False, "error": "无权限"}), 403
     
-    # 获取参数
-    data = request.json
+    # 获取参数（非法 JSON、或 JSON 不是对象（列表、数字等）时按参数错误处理）
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "error": "参数错误"}), 400
     transaction_type = data.get("type")
     message_id = data.get("message_id")
     
@@ -380,4 +443,5 @@ if __name__ == "__main__":
     # 优先使用PORT（ClawCloud），如果不存在则使用WEB_PORT（本地）
     port = int(os.getenv("PORT", os.getenv("WEB_PORT", "5000")))
     print(f"🌐 Web应用启动在端口: {port}")
+    print("⚠️ 当前为 Flask 开发服务器，生产环境请使用: gunicorn -k gthread --threads 8 wsgi:application")
     app.run(host="0.0.0.0", port=port, debug=False)
@@ -1,5 +1,8 @@
 """
 WSGI配置文件 - 用于AlwaysData部署
+
+生产环境请用多线程 WSGI 服务器启动，不要用 Flask 自带的开发服务器：
+    gunicorn -w 1 -k gthread --threads 8 --bind 0.0.0.0:$PORT wsgi:application
 """
 import os
 import sys
@@ -9,8 +12,8 @@ project_home = os.path.dirname(__file__)
 if project_home not in sys.path:
     sys.path.insert(0, project_home)
 
-# 导入Flask应用
-from app import app as application
+# 导入Flask应用（Web 看板；app.py 是纯 Bot 进程，没有 Flask 实例）
+from web_app import app as application
 
 # AlwaysData会调用这个application对象
 if __name__ == "__main__":